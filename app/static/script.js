@@ -1,14 +1,72 @@
+// Each browser gets its own reviewer id so the server leases it a distinct image,
+// even when several reviewers share one address.
+function reviewerId() {
+    let id = localStorage.getItem('reviewerId');
+    if (!id) {
+        id = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+        localStorage.setItem('reviewerId', id);
+    }
+    return id;
+}
+
+const reviewHeaders = { 'X-Reviewer-Id': reviewerId() };
+
+function showMessage(message) {
+    document.getElementById('review').hidden = true;
+    document.getElementById('message').hidden = false;
+    document.getElementById('messageText').textContent = message;
+    document.getElementById('status').textContent = '';
+}
+
+function showReview(data) {
+    document.querySelector('img').src = '/images/' + encodeURI(data.image_path);
+    document.getElementById('gemma_caption').value = data.gemma_caption;
+    document.getElementById('manual_caption').value = '';
+    document.getElementById('proposedCaption').textContent = data.proposed_caption || '';
+    document.getElementById('proposal').hidden = !data.proposed_caption;
+    document.getElementById('gemma_evaluation').innerHTML = '';
+    document.getElementById('manual_evaluation').innerHTML = '';
+    document.getElementById('review').hidden = false;
+}
+
+function readJson(response) {
+    return response.json().then(data => {
+        if (!response.ok) {
+            throw new Error(data.detail || response.statusText);
+        }
+        return data;
+    });
+}
+
+fetch('/review', { headers: reviewHeaders })
+    .then(readJson)
+    .then(data => {
+        if (data.done) {
+            showMessage('All images have been processed!');
+        } else {
+            showReview(data);
+            document.getElementById('status').textContent = '';
+        }
+    })
+    .catch(error => {
+        showMessage('Error processing first image: ' + error.message);
+    });
+
+document.getElementById('useProposal').addEventListener('click', function() {
+    document.getElementById('manual_caption').value = document.getElementById('proposedCaption').textContent;
+});
+
 document.getElementById('checkButton').addEventListener('click', function() {
     const gemmaCaption = document.getElementById('gemma_caption').value;
     const manualCaption = document.getElementById('manual_caption').value;
-    const imagePath = document.querySelector('img').src.split('/images/')[1];
+    const imagePath = decodeURIComponent(document.querySelector('img').src.split('/images/')[1]);
     const status = document.getElementById('status');
 
     status.textContent = 'Checking with Pixtral...';
 
     fetch('/review', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { ...reviewHeaders, 'Content-Type': 'application/json' },
         body: JSON.stringify({
             action: 'check',
             image_path: imagePath,
@@ -16,7 +74,7 @@ document.getElementById('checkButton').addEventListener('click', function() {
             manual_caption: manualCaption
         })
     })
-    .then(response => response.json())
+    .then(readJson)
     .then(data => {
         status.textContent = '';
         document.getElementById('gemma_evaluation').innerHTML = data.gemma_score !== null 
@@ -34,7 +92,7 @@ document.getElementById('checkButton').addEventListener('click', function() {
 document.getElementById('saveNext').addEventListener('click', function() {
     const gemmaCaption = document.getElementById('gemma_caption').value;
     const manualCaption = document.getElementById('manual_caption').value;
-    const imagePath = document.querySelector('img').src.split('/images/')[1];
+    const imagePath = decodeURIComponent(document.querySelector('img').src.split('/images/')[1]);
     const status = document.getElementById('status');
     const gemmaScore = document.getElementById('gemma_evaluation').querySelector('p:nth-child(2)')?.textContent.split(': ')[1]?.split('/')[0] || null;
     const manualScore = document.getElementById('manual_evaluation').querySelector('p:nth-child(2)')?.textContent.split(': ')[1]?.split('/')[0] || null;
@@ -43,7 +101,7 @@ document.getElementById('saveNext').addEventListener('click', function() {
 
     fetch('/review', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { ...reviewHeaders, 'Content-Type': 'application/json' },
         body: JSON.stringify({
             action: 'save',
             image_path: imagePath,
@@ -53,20 +111,12 @@ document.getElementById('saveNext').addEventListener('click', function() {
             manual_score: manualScore ? parseInt(manualScore) : null
         })
     })
-    .then(response => response.json())
+    .then(readJson)
     .then(data => {
         if (data.done) {
-            status.textContent = data.message;
-            document.getElementById('saveNext').style.display = 'none';
-            document.querySelector('.container').innerHTML += '<a href="/" class="btn">Back to Home</a>';
-        } else if (data.error) {
-            status.textContent = data.error;
+            showMessage(data.message);
         } else {
-            document.querySelector('img').src = '/images/' + data.image_path;
-            document.getElementById('gemma_caption').value = data.caption;
-            document.getElementById('manual_caption').value = '';
-            document.getElementById('gemma_evaluation').innerHTML = '';
-            document.getElementById('manual_evaluation').innerHTML = '';
+            showReview(data);
             status.textContent = `Processed ${data.image_path} (Remaining: ${data.total})`;
         }
     })
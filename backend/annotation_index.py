@@ -0,0 +1,294 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from metrics import log
+
+ANNOTATION_FIELDS = (
+    "image", "folder", "created_at",
+    "gemma_caption", "gemma_score", "gemma_explanation",
+    "manual_caption", "manual_score", "manual_explanation",
+)
+SCORE_COLUMNS = {"gemma": "gemma_score", "manual": "manual_score"}
+
+
+class AnnotationQueryError(Exception):
+    pass
+
+
+def encode_cursor(created_at: float, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, row_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise AnnotationQueryError("Invalid cursor")
+
+
+def match_query(text: str) -> str:
+    """Turn free text into an FTS5 query that matches every word, so user input is never parsed as FTS syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+class AnnotationIndex:
+    """Queryable SQLite index of the saved annotations, built from the JSONL stores.
+
+    The JSONL files stay the source of truth. ``sync`` reads only the bytes
+    appended since the last sync (by this process or any other writer) and
+    upserts one row per image that joins the generated caption with the
+    manual caption saved alongside it. If a store shrank (it was cleared),
+    the index is rebuilt.
+
+    Listing is newest first with keyset pagination, so every page costs the
+    same however deep it is. Row ids follow save order (a re-saved image gets
+    a new row), so plain and full-text listings walk the rowid; a date window
+    walks the ``(created_at, id)`` index instead. Captions are full-text
+    indexed with FTS5.
+    """
+
+    def __init__(self, db_path: str, generated_path: str, manual_path: str):
+        self.db_path = db_path
+        self.paths = {"generated": generated_path, "manual": manual_path}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS annotations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image TEXT NOT NULL UNIQUE,
+                folder TEXT NOT NULL,
+                created_at REAL NOT NULL DEFAULT 0,
+                gemma_caption TEXT,
+                gemma_score INTEGER,
+                gemma_explanation TEXT,
+                manual_caption TEXT,
+                manual_score INTEGER,
+                manual_explanation TEXT,
+                has_manual INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS annotations_created ON annotations(created_at, id);
+            CREATE INDEX IF NOT EXISTS annotations_folder ON annotations(folder);
+            CREATE VIRTUAL TABLE IF NOT EXISTS annotations_fts USING fts5(
+                gemma_caption, manual_caption, content='annotations', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS annotations_ai AFTER INSERT ON annotations BEGIN
+                INSERT INTO annotations_fts (rowid, gemma_caption, manual_caption)
+                VALUES (new.id, new.gemma_caption, new.manual_caption);
+            END;
+            CREATE TRIGGER IF NOT EXISTS annotations_ad AFTER DELETE ON annotations BEGIN
+                INSERT INTO annotations_fts (annotations_fts, rowid, gemma_caption, manual_caption)
+                VALUES ('delete', old.id, old.gemma_caption, old.manual_caption);
+            END;
+            CREATE TRIGGER IF NOT EXISTS annotations_au AFTER UPDATE ON annotations BEGIN
+                INSERT INTO annotations_fts (annotations_fts, rowid, gemma_caption, manual_caption)
+                VALUES ('delete', old.id, old.gemma_caption, old.manual_caption);
+                INSERT INTO annotations_fts (rowid, gemma_caption, manual_caption)
+                VALUES (new.id, new.gemma_caption, new.manual_caption);
+            END;
+            CREATE TABLE IF NOT EXISTS offsets (
+                store TEXT PRIMARY KEY,
+                position INTEGER NOT NULL
+            );
+            """
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def sync(self) -> int:
+        """Index entries appended to the stores since the last sync. Returns how many were read.
+
+        Each chunk is read and indexed inside one write transaction that
+        starts from the stored offset, so several processes can sync the same
+        database without indexing an entry twice.
+        """
+        with self._lock:
+            offsets = dict(self._conn.execute("SELECT store, position FROM offsets"))
+            if all(self._size(store) == offsets.get(store, 0) for store in self.paths):
+                return 0
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                if any(self._size(store) < self._offset(store) for store in self.paths):
+                    # A store shrank, so it was cleared: start over from both.
+                    self._conn.execute("DELETE FROM annotations")
+                    self._conn.execute("DELETE FROM offsets")
+            read = 0
+            for store in ("generated", "manual"):
+                while True:
+                    with self._conn:
+                        self._conn.execute("BEGIN IMMEDIATE")
+                        offset = self._offset(store)
+                        if offset >= self._size(store):
+                            break
+                        entries, next_offset = self._read(self.paths[store], offset)
+                        if next_offset == offset:
+                            break
+                        for entry in entries:
+                            if store == "generated":
+                                self._upsert_generated(entry)
+                            else:
+                                self._upsert_manual(entry)
+                        self._conn.execute(
+                            "INSERT INTO offsets (store, position) VALUES (?, ?) "
+                            "ON CONFLICT(store) DO UPDATE SET position = excluded.position",
+                            (store, next_offset),
+                        )
+                    read += len(entries)
+            if read:
+                self._conn.execute("PRAGMA optimize")
+            return read
+
+    def _size(self, store: str) -> int:
+        path = self.paths[store]
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _offset(self, store: str) -> int:
+        row = self._conn.execute("SELECT position FROM offsets WHERE store = ?", (store,)).fetchone()
+        return row[0] if row else 0
+
+    def rebuild(self) -> int:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM annotations")
+            self._conn.execute("DELETE FROM offsets")
+        return self.sync()
+
+    @staticmethod
+    def _read(path: str, offset: int, max_bytes: int = 8 * 1024 * 1024) -> tuple:
+        """Return the entries in the complete lines of the next ``max_bytes`` after ``offset``, and the offset after them."""
+        with open(path, "rb") as file:
+            file.seek(offset)
+            data = file.read(max_bytes)
+        end = data.rfind(b"\n") + 1
+        entries = []
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                log(f"Warning: Skipping invalid line in {path}", level="warning")
+                continue
+            if isinstance(entry, dict) and entry.get("image"):
+                entries.append(entry)
+        return entries, offset + end
+
+    def _upsert_generated(self, entry: dict):
+        # A newer save of the same image replaces the row, manual caption included,
+        # under a new id, so ids always follow save order.
+        image, created_at = entry["image"], entry.get("created_at") or 0
+        row = self._conn.execute("SELECT created_at FROM annotations WHERE image = ?", (image,)).fetchone()
+        if row is not None and created_at < row[0]:
+            return
+        if row is not None and created_at == row[0]:
+            self._conn.execute(
+                "UPDATE annotations SET gemma_caption = ?, gemma_score = ?, gemma_explanation = ? WHERE image = ?",
+                (entry.get("caption"), entry.get("score"), entry.get("explanation"), image),
+            )
+            return
+        if row is not None:
+            self._conn.execute("DELETE FROM annotations WHERE image = ?", (image,))
+        self._conn.execute(
+            "INSERT INTO annotations (image, folder, created_at, gemma_caption, gemma_score, gemma_explanation) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (image, image.rpartition("/")[0], created_at, entry.get("caption"), entry.get("score"), entry.get("explanation")),
+        )
+
+    def _upsert_manual(self, entry: dict):
+        image, created_at = entry["image"], entry.get("created_at") or 0
+        row = self._conn.execute("SELECT created_at FROM annotations WHERE image = ?", (image,)).fetchone()
+        if row is None:
+            self._conn.execute(
+                "INSERT INTO annotations (image, folder, created_at) VALUES (?, ?, ?)",
+                (image, image.rpartition("/")[0], created_at),
+            )
+        elif created_at < row[0]:
+            return
+        self._conn.execute(
+            "UPDATE annotations SET manual_caption = ?, manual_score = ?, manual_explanation = ?, has_manual = ? "
+            "WHERE image = ?",
+            (entry.get("caption"), entry.get("score"), entry.get("explanation"), int(bool(entry.get("caption"))), image),
+        )
+
+    def query(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        min_score: Optional[int] = None,
+        max_score: Optional[int] = None,
+        score_of: str = "gemma",
+        has_manual: Optional[bool] = None,
+        folder: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        text: Optional[str] = None,
+    ) -> dict:
+        """Return one page of annotations, newest first, and the cursor for the next page."""
+        if score_of not in SCORE_COLUMNS:
+            raise AnnotationQueryError("score_of must be one of gemma, manual")
+        where, params = [], []
+        if min_score is not None:
+            where.append(f"a.{SCORE_COLUMNS[score_of]} >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            where.append(f"a.{SCORE_COLUMNS[score_of]} <= ?")
+            params.append(max_score)
+        if has_manual is not None:
+            where.append("a.has_manual = ?")
+            params.append(int(has_manual))
+        if folder:
+            # The range can use the folder index; the OR then drops siblings such as "a-b" for folder "a".
+            prefix = folder.strip("/")
+            where.append("a.folder >= ? AND a.folder < ? AND (a.folder = ? OR a.folder >= ?)")
+            params.extend([prefix, f"{prefix}0", prefix, f"{prefix}/"])
+        if since is not None:
+            where.append("a.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("a.created_at < ?")
+            params.append(until)
+
+        columns = ", ".join(f"a.{field}" for field in ANNOTATION_FIELDS)
+        sql = f"SELECT a.id, {columns} FROM annotations AS a"
+        rowid = "a.id"
+        if text and text.strip():
+            # Drive the query from the full-text index, which already yields rowids newest first.
+            sql = f"SELECT a.id, {columns} FROM annotations_fts JOIN annotations AS a ON a.id = annotations_fts.rowid"
+            where.insert(0, "annotations_fts MATCH ?")
+            params.insert(0, match_query(text))
+            rowid = "annotations_fts.rowid"
+        by_date = rowid == "a.id" and (since is not None or until is not None)
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            if by_date:
+                where.append("(a.created_at, a.id) < (?, ?)")
+                params.extend([created_at, row_id])
+            else:
+                where.append(f"{rowid} < ?")
+                params.append(row_id)
+        # A date window walks the (created_at, id) index; everything else walks rowids.
+        order = "a.created_at DESC, a.id DESC" if by_date else f"{rowid} DESC"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order} LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, (*params, limit + 1)).fetchall()
+        items = [dict(zip(ANNOTATION_FIELDS, row[1:])) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last[3], last[0])
+        return {"items": items, "next_cursor": next_cursor}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
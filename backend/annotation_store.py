@@ -0,0 +1,136 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Iterator, Optional
+
+from metrics import log
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class AnnotationStore:
+    """Append-only JSONL store for caption entries.
+
+    All writes go through a single writer thread. Appends that queue up while
+    a write is in progress are written and fsynced together, so each caller
+    waits for at most one fsync no matter how many reviewers are saving.
+    ``append`` returns a ``Future`` that resolves once the entry is durable.
+
+    On first use an existing JSON array file (the old format) is migrated to
+    JSONL and renamed to ``<name>.migrated``.
+    """
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None):
+        self.path = path
+        if legacy_json_path:
+            self._migrate(legacy_json_path)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._write_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name=f"annotation-writer:{path}", daemon=True)
+        self._writer.start()
+
+    def _migrate(self, legacy_json_path: str):
+        if os.path.exists(self.path) or not os.path.exists(legacy_json_path):
+            return
+        try:
+            with open(legacy_json_path, "r") as file:
+                content = file.read().strip()
+                entries = json.loads(content) if content else []
+        except json.JSONDecodeError:
+            log(f"Warning: Invalid JSON in {legacy_json_path}. Skipping migration.", level="warning")
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            for entry in entries:
+                file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        os.replace(legacy_json_path, f"{legacy_json_path}.migrated")
+        log(f"Migrated {len(entries)} entries from {legacy_json_path} to {self.path}")
+
+    def append(self, entry: dict) -> Future:
+        future: Future = Future()
+        self._queue.put((json.dumps(entry) + "\n", future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        os.close(self._fd)
+
+    def clear(self):
+        with self._write_lock:
+            self._locked(lambda: os.ftruncate(self._fd, 0))
+            os.fsync(self._fd)
+
+    def exclusive(self, operation):
+        """Run ``operation`` while no thread or process can append, e.g. to reconcile an index with the store."""
+        with self._write_lock:
+            return self._locked(operation)
+
+    def __iter__(self) -> Iterator[dict]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    log(f"Warning: Skipping invalid line in {self.path}", level="warning")
+
+    def images(self) -> set:
+        return {entry["image"] for entry in self}
+
+    def _locked(self, operation):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            return operation()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write(self, data: bytes):
+        while data:
+            written = os.write(self._fd, data)
+            data = data[written:]
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            data = "".join(line for line, _ in batch).encode("utf-8")
+            try:
+                with self._write_lock:
+                    self._locked(lambda: self._write(data))
+                    os.fsync(self._fd)
+            except Exception as e:
+                log(f"Error writing to {self.path}: {str(e)}", level="error")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for _, future in batch:
+                future.set_result(None)
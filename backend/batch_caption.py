@@ -0,0 +1,161 @@
+"""Caption every unprocessed image in CarData without the review UI.
+
+Runs ``process_image_with_gemma`` over the pending images with a pool of
+async workers, a token-bucket rate limit and an append-only checkpoint file
+so an interrupted run resumes where it stopped:
+
+    python batch_caption.py --workers 8 --rate 0.3 --burst 2
+
+With ``--batch-size K`` each worker packs up to K images into one request
+(see ``caption_batch``) and falls back to single-image requests when the
+reply cannot be split per image.
+
+Captions go to the generated-caption store (and the caption cache). Images
+leased to a reviewer are skipped, and an image a reviewer leases or saves
+while it is being captioned keeps only the cached caption (counted as
+``taken``). With
+``--cache-only`` they only warm the cache, so /review serves them instantly
+while images still go through human review. Point ``--api-url`` (or the
+OPENROUTER_URL environment variable) at ``mock_openrouter.py``, or set
+MODEL_BACKEND=stub, to measure throughput offline.
+"""
+import argparse
+import asyncio
+import time
+
+import core
+from annotation_store import AnnotationStore
+from rate_limit import TokenBucket
+
+BATCH_REVIEWER = "batch"
+
+
+def load_checkpoint(checkpoint: AnnotationStore):
+    done = set()
+    failures: dict = {}
+    for entry in checkpoint:
+        if entry.get("status") == "done":
+            done.add(entry["image"])
+            failures.pop(entry["image"], None)
+        else:
+            failures[entry["image"]] = failures.get(entry["image"], 0) + 1
+    return done, failures
+
+
+async def run(args) -> dict:
+    if args.api_url:
+        core.model_backend.url = args.api_url
+    core.model_backend.max_concurrency = args.workers
+    if args.rate > 0:
+        core.model_backend.rate_limiter = TokenBucket(args.rate, args.burst)
+
+    await asyncio.to_thread(core.sync_image_index)
+    checkpoint = AnnotationStore(args.checkpoint)
+    done, failures = load_checkpoint(checkpoint)
+    print(f"Resuming with {len(done)} images done and {len(failures)} failed earlier")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.workers * args.batch_size * 2)
+    stats = {"captioned": 0, "failed": 0, "skipped": 0, "taken": 0}
+    started = time.monotonic()
+
+    async def produce():
+        queued = 0
+        for image_path, relative_path in core.image_index.iter_pending():
+            if args.limit and queued >= args.limit:
+                break
+            if relative_path in done or failures.get(relative_path, 0) >= args.max_failures:
+                stats["skipped"] += 1
+                continue
+            await queue.put((image_path, relative_path))
+            queued += 1
+        for _ in range(args.workers):
+            await queue.put(None)
+
+    async def record(relative_path: str, caption):
+        if caption is None:
+            stats["failed"] += 1
+            await asyncio.wrap_future(checkpoint.append({"image": relative_path, "status": "failed"}))
+            return
+        if not args.cache_only:
+            # A reviewer may have leased or saved the image meanwhile; then only the cache keeps the caption.
+            if not await asyncio.to_thread(core.image_index.claim, relative_path, BATCH_REVIEWER):
+                stats["taken"] += 1
+                return
+            try:
+                await asyncio.wrap_future(core.generated_store.append(
+                    {"image": relative_path, "caption": caption, "created_at": time.time(), "source": "batch"}
+                ))
+            except BaseException:
+                await asyncio.to_thread(core.image_index.mark_processed, relative_path, False)
+                raise
+            await asyncio.to_thread(core.image_index.mark_processed, relative_path)
+        await asyncio.wrap_future(checkpoint.append({"image": relative_path, "status": "done"}))
+        stats["captioned"] += 1
+
+    async def work():
+        finished = False
+        while not finished:
+            items = []
+            while len(items) < args.batch_size:
+                if items and queue.empty():
+                    break
+                item = await queue.get()
+                if item is None:
+                    finished = True
+                    break
+                items.append(item)
+            if not items:
+                continue
+            if args.batch_size > 1:
+                captions = await core.process_images_with_gemma(items, args.batch_size)
+            else:
+                captions = [await core.process_image_with_gemma(*items[0])]
+            for (_, relative_path), caption in zip(items, captions):
+                await record(relative_path, caption)
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.report_every)
+            elapsed = time.monotonic() - started
+            print(f"{stats['captioned']} captioned, {stats['failed']} failed, "
+                  f"{stats['captioned'] / elapsed:.2f} images/s")
+
+    reporter = asyncio.create_task(report())
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(args.workers)))
+    finally:
+        reporter.cancel()
+        checkpoint.close()
+        await core.model_backend.close()
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["images_per_second"] = round(stats["captioned"] / elapsed, 3) if elapsed else 0.0
+    return stats
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Batch-caption unprocessed CarData images with Gemma.")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent model requests.")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Images packed into one request (1 sends one image per request).")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Requests per second allowed upstream (0 disables rate limiting).")
+    parser.add_argument("--burst", type=float, default=1, help="Token bucket capacity.")
+    parser.add_argument("--checkpoint", default="batch_caption_checkpoint.jsonl")
+    parser.add_argument("--max-failures", type=int, default=3,
+                        help="Skip images that already failed this many times.")
+    parser.add_argument("--limit", type=int, default=0, help="Caption at most this many images.")
+    parser.add_argument("--cache-only", action="store_true",
+                        help="Only warm the caption cache; leave images pending for review.")
+    parser.add_argument("--api-url", default="", help="Override OPENROUTER_URL, e.g. a mock server.")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines.")
+    args = parser.parse_args()
+
+    stats = asyncio.run(run(args))
+    core.generated_store.close()
+    print(f"Done: {stats}")
+
+
+if __name__ == "__main__":
+    main_cli()
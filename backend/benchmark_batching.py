@@ -0,0 +1,123 @@
+"""Compare single-image and batched Gemma captioning against the mock server.
+
+Generates synthetic images in a temporary working directory, starts
+``mock_openrouter`` in-process and captions every image twice through the
+real ``core`` code paths: once with one image per request and once with
+``--batch-size`` images per request. Images are encoded once up front so
+both runs measure request overhead only. Prints images/sec and prompt and
+completion tokens per image for each run as JSON:
+
+    python benchmark_batching.py --images 64 --batch-size 4 --concurrency 4 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image
+
+from mock_openrouter import start_mock_server
+
+
+def make_images(root_folder: str, count: int, seed: int):
+    rng = random.Random(seed)
+    folder = os.path.join(root_folder, "benchmark")
+    os.makedirs(folder, exist_ok=True)
+    for number in range(count):
+        image = Image.new("RGB", (1600, 1200), tuple(rng.randrange(256) for _ in range(3)))
+        image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(64 * 48)] * 625)
+        image.save(os.path.join(folder, f"car_{number:05d}.jpg"), quality=90)
+
+
+async def mock_stats(url: str) -> dict:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(url.replace("/api/v1/chat/completions", "/stats"))
+        return response.json()
+
+
+async def run_mode(core, items: list, batch_size: int, concurrency: int, url: str) -> dict:
+    core.model_cache.clear()
+    before = await mock_stats(url)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def caption(chunk: list) -> list:
+        async with semaphore:
+            if batch_size > 1:
+                return await core.process_images_with_gemma(chunk, batch_size)
+            return [await core.process_image_with_gemma(*chunk[0])]
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        caption(items[start:start + batch_size]) for start in range(0, len(items), batch_size)
+    ))
+    elapsed = time.perf_counter() - started
+    after = await mock_stats(url)
+
+    captioned = sum(1 for chunk in results for caption in chunk if caption is not None)
+    return {
+        "batch_size": batch_size,
+        "images": len(items),
+        "captioned": captioned,
+        "requests": after["requests"] - before["requests"],
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(captioned / elapsed, 3) if elapsed else 0.0,
+        "prompt_tokens_per_image": round((after["prompt_tokens"] - before["prompt_tokens"]) / len(items), 1),
+        "completion_tokens_per_image": round(
+            (after["completion_tokens"] - before["completion_tokens"]) / len(items), 1
+        ),
+    }
+
+
+async def run(args) -> dict:
+    import core
+
+    core.model_backend.max_concurrency = max(args.concurrency, 1)
+    await asyncio.to_thread(core.sync_image_index)
+    items = core.image_index.pending(args.images)
+    await asyncio.gather(*(asyncio.to_thread(core.encode_image, image_path) for image_path, _ in items))
+    try:
+        single = await run_mode(core, items, 1, args.concurrency, core.OPENROUTER_URL)
+        batched = await run_mode(core, items, args.batch_size, args.concurrency, core.OPENROUTER_URL)
+    finally:
+        await core.model_backend.close()
+    return {
+        "single": single,
+        "batched": batched,
+        "speedup": round(batched["images_per_second"] / single["images_per_second"], 2)
+        if single["images_per_second"] else None,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark batched Gemma captioning against a mock server.")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock seconds per request.")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url, _ = start_mock_server(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    os.environ["OPENROUTER_URL"] = url
+    os.environ["MODEL_BACKEND"] = "openrouter"
+    # Near-duplicate captions would answer the second run without any requests.
+    os.environ["NEAR_DUPLICATE_CAPTIONS"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        make_images("CarData", args.images, args.seed)
+        report = asyncio.run(run(args))
+        import core
+        core.close_storage()
+    server.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
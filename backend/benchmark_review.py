@@ -0,0 +1,244 @@
+"""Reproducible benchmark of the review loop against a mock OpenRouter server.
+
+Builds a synthetic ``CarData`` tree in a temporary data directory, starts
+``mock_openrouter`` in-process with the given latency and error rate (or
+uses the in-process stub backend with ``--backend stub``), and drives the
+FastAPI app in-process (``httpx.ASGITransport``) with simulated
+reviewers. Each reviewer fetches an image, optionally checks the captions,
+and saves, until ``--saves`` images are saved or ``--duration`` runs out.
+
+The report covers:
+- p50/p95/p99 latency per endpoint;
+- images/hour;
+- the cost of the index scan, ``get_all_images`` and store appends;
+- peak memory.
+
+It is printed as JSON (and written to ``--output``) so runs can be diffed:
+
+    python benchmark_review.py --images 2000 --reviewers 8 --latency 0.5 --error-rate 0.02 --output run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+from PIL import Image, ImageEnhance
+
+from mock_openrouter import start_mock_server
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples: list, errors: int = 0) -> dict:
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "mean_ms": round(1000 * sum(samples) / len(samples), 2) if samples else 0.0,
+        "p50_ms": round(1000 * percentile(samples, 0.50), 2),
+        "p95_ms": round(1000 * percentile(samples, 0.95), 2),
+        "p99_ms": round(1000 * percentile(samples, 0.99), 2),
+        "max_ms": round(1000 * max(samples), 2) if samples else 0.0,
+    }
+
+
+def make_car_data(root_folder: str, images: int, folders: int, edge: int, seed: int, duplicate_rate: float = 0.0):
+    """Write ``images`` distinct synthetic photos; ``duplicate_rate`` of them are
+    slightly brightened copies of the previous one, like burst shots."""
+    rng = random.Random(seed)
+    per_folder = max(-(-images // max(folders, 1)), 1)
+    image = None
+    for number in range(images):
+        folder = os.path.join(root_folder, f"batch_{number // per_folder:03d}")
+        os.makedirs(folder, exist_ok=True)
+        if image is not None and rng.random() < duplicate_rate:
+            image = ImageEnhance.Brightness(image).enhance(rng.uniform(0.95, 1.05))
+        else:
+            pattern = bytes(rng.randrange(256) for _ in range(16 * 12 * 3))
+            image = Image.frombytes("RGB", (16, 12), pattern).resize((edge, edge * 3 // 4), Image.BICUBIC)
+        image.save(os.path.join(folder, f"car_{number:06d}.jpg"))
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict = {}
+        self.errors: dict = {}
+
+    def add(self, endpoint: str, seconds: float, ok: bool):
+        self.samples.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self) -> dict:
+        return {endpoint: summarize(samples, self.errors.get(endpoint, 0)) for endpoint, samples in self.samples.items()}
+
+
+async def timed(recorder: Recorder, endpoint: str, request):
+    started = time.perf_counter()
+    try:
+        response = await request
+    except Exception as e:
+        recorder.add(endpoint, time.perf_counter() - started, False)
+        print(f"{endpoint} failed: {str(e)}")
+        return None
+    recorder.add(endpoint, time.perf_counter() - started, response.status_code < 400)
+    return response
+
+
+async def reviewer(client: httpx.AsyncClient, recorder: Recorder, number: int, args, state: dict, deadline: float):
+    rng = random.Random(args.seed + number)
+    headers = {"X-Reviewer-Id": f"bench-{number}"}
+    response = await timed(recorder, "GET /review", client.get("/review", headers=headers))
+    while response is not None and time.monotonic() < deadline and state["saved"] < args.saves:
+        data = response.json()
+        if data.get("done") or "image_path" not in data:
+            if response.status_code >= 400:
+                response = await timed(recorder, "GET /review", client.get("/review", headers=headers))
+                continue
+            return
+        body = {
+            "image_path": data["image_path"],
+            "gemma_caption": data["gemma_caption"],
+            "manual_caption": f"Manual caption {number}-{state['saved']}",
+        }
+        if rng.random() < args.check_rate:
+            await timed(recorder, "POST /review check", client.post(
+                "/review", headers=headers, json={**body, "action": "check"}
+            ))
+        if args.think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+        response = await timed(recorder, "POST /review save", client.post(
+            "/review", headers=headers, json={**body, "action": "save"}
+        ))
+        if response is not None and response.status_code < 400:
+            state["saved"] += 1
+
+
+def time_calls(function, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+async def run(args) -> dict:
+    import core
+    import main
+
+    started = time.perf_counter()
+    await asyncio.to_thread(core.sync_image_index)
+    components = {"index_sync_seconds": round(time.perf_counter() - started, 3)}
+    components["get_all_images"] = time_calls(lambda: core.get_all_images(1), args.component_repeat)
+    components["store_append"] = time_calls(
+        lambda: core.manual_store.append({"image": "benchmark", "caption": "x", "created_at": 0}).result(),
+        args.component_repeat,
+    )
+    core.manual_store.clear()
+
+    recorder = Recorder()
+    state = {"saved": 0}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            started = time.monotonic()
+            deadline = started + args.duration
+            await asyncio.gather(*(
+                reviewer(client, recorder, number, args, state, deadline) for number in range(args.reviewers)
+            ))
+            elapsed = time.monotonic() - started
+            prefetch = (await client.get("/prefetch_stats")).json()
+            api = (await client.get("/api_stats")).json()
+            near_duplicates = (await client.get("/cache_stats")).json()["near_duplicates"]
+
+    return {
+        "saved": state["saved"],
+        "seconds": round(elapsed, 3),
+        "images_per_hour": round(state["saved"] / elapsed * 3600, 1) if elapsed else 0.0,
+        "endpoints": recorder.report(),
+        "components": components,
+        "prefetch": prefetch,
+        "api": api,
+        "near_duplicates": near_duplicates,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the review loop against a mock OpenRouter server.")
+    parser.add_argument("--images", type=int, default=500, help="Synthetic images to generate.")
+    parser.add_argument("--folders", type=int, default=10, help="Folders the images are spread over.")
+    parser.add_argument("--image-edge", type=int, default=640, help="Width of the synthetic images in pixels.")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="Share of images that are near-duplicates of the previous one.")
+    parser.add_argument("--reviewers", type=int, default=4, help="Concurrent simulated reviewers.")
+    parser.add_argument("--saves", type=int, default=200, help="Stop after this many saves in total.")
+    parser.add_argument("--duration", type=float, default=300.0, help="Stop after this many seconds.")
+    parser.add_argument("--check-rate", type=float, default=0.5, help="Share of images checked before saving.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean reviewer pause before saving, in seconds.")
+    parser.add_argument("--backend", choices=("openrouter", "stub"), default="openrouter",
+                        help="openrouter talks HTTP to the mock server; stub answers in-process.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock seconds per request (per batch for stub).")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock requests failing with 429/5xx.")
+    parser.add_argument("--component-repeat", type=int, default=200, help="Calls per component timing.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the Python heap peak (slower).")
+    parser.add_argument("--output", default="", help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    server, url, mock_state = start_mock_server(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed
+    )
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["CAR_DAMAGE_DATA_DIR"] = data_dir
+        os.environ["OPENROUTER_URL"] = url
+        os.environ["MODEL_BACKEND"] = args.backend
+        os.environ["STUB_LATENCY"] = str(args.latency)
+        started = time.perf_counter()
+        make_car_data(
+            os.path.join(data_dir, "CarData"), args.images, args.folders, args.image_edge, args.seed, args.duplicate_rate
+        )
+        generate_seconds = time.perf_counter() - started
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        results = asyncio.run(run(args))
+
+    memory = {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if args.tracemalloc:
+        memory["python_heap_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    server.shutdown()
+
+    report = {
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "generate_seconds": round(generate_seconds, 3),
+        **results,
+        "mock": {"requests": mock_state.requests, "errors": mock_state.errors},
+        "memory": memory,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main_cli()
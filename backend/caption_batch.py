@@ -0,0 +1,108 @@
+import asyncio
+import re
+from typing import Awaitable, Callable, Optional
+
+from metrics import log
+
+IMAGE_MARKER = "[[IMAGE {}]]"
+MARKER_PATTERN = re.compile(r"\[\[IMAGE (\d+)\]\]")
+
+
+def build_batch_payload(model: str, prompt: str, image_urls: list) -> dict:
+    """Pack several images into one chat completion request.
+
+    Each image is preceded by its ``[[IMAGE n]]`` marker and the model is asked
+    to answer every image under the same marker, so ``parse_batch_reply`` can
+    split the reply again.
+    """
+    count = len(image_urls)
+    instructions = (
+        f"You are given {count} images, each preceded by a marker from {IMAGE_MARKER.format(1)} "
+        f"to {IMAGE_MARKER.format(count)}. Apply the following instructions to each image separately. "
+        f"Answer with exactly {count} sections, each starting with the image's marker on its own line "
+        "followed by the description for that image only.\n\n"
+        f"{prompt}"
+    )
+    content = [{"type": "text", "text": instructions}]
+    for number, image_url in enumerate(image_urls, 1):
+        content.append({"type": "text", "text": IMAGE_MARKER.format(number)})
+        content.append({"type": "image_url", "image_url": {"url": image_url}})
+    return {"model": model, "messages": [{"role": "user", "content": content}]}
+
+
+def parse_batch_reply(text: str, count: int) -> Optional[list]:
+    """Split a batched reply into ``count`` captions, or ``None`` if any is missing."""
+    pieces = MARKER_PATTERN.split(text)
+    captions: dict = {}
+    for index in range(1, len(pieces) - 1, 2):
+        number = int(pieces[index])
+        caption = pieces[index + 1].strip()
+        if 1 <= number <= count and caption and number not in captions:
+            captions[number] = caption
+    if len(captions) != count:
+        return None
+    return [captions[number] for number in range(1, count + 1)]
+
+
+class CaptionBatcher:
+    """Collects single-image caption calls into small batches.
+
+    Calls to ``caption`` that arrive within ``window`` seconds of each other
+    are passed together to ``caption_many`` (a list of ``(image_path,
+    relative_path)`` pairs in, a list of captions out), at most ``max_batch``
+    at a time. A full batch is sent without waiting for the window to end.
+    """
+
+    def __init__(self, caption_many: Callable[[list], Awaitable[list]], max_batch: int = 4, window: float = 0.05):
+        self.caption_many = caption_many
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self.images = 0
+        self._pending: list = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()  # The loop only keeps weak references to running tasks
+
+    async def caption(self, image_path: str, relative_path: str) -> Optional[str]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((image_path, relative_path), future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "window": self.window,
+            "batches": self.batches,
+            "images": self.images,
+            "average_batch": round(self.images / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            self.batches += 1
+            self.images += len(batch)
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        # Callers that gave up (e.g. a cancelled prefetch slot) are skipped.
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            captions = await self.caption_many([item for item, _ in batch])
+        except Exception as e:
+            log(f"Error captioning batch of {len(batch)} images: {str(e)}", level="error")
+            captions = [None] * len(batch)
+        for (_, future), caption in zip(batch, captions):
+            if not future.done():
+                future.set_result(caption)
@@ -0,0 +1,503 @@
+"""Shared core of the review server: configuration, storage, caches, the model
+client and the caption/evaluation pipeline.
+
+``main`` serves it over HTTP; ``batch_caption`` and the benchmarks drive it
+directly. Everything that touches the disk or the model is built lazily on
+first use (see ``lazy.Lazy``), so importing this module is cheap however big
+``CarData`` and the databases are. ``start`` brings the indexes up to date in
+the background, and several server processes can share one data directory
+(``WORKERS`` in ``main``).
+"""
+import os
+import asyncio
+import socket
+import time
+from typing import Optional
+from annotation_index import AnnotationIndex
+from annotation_store import AnnotationStore
+from caption_batch import CaptionBatcher, build_batch_payload, parse_batch_reply
+from image_index import ImageIndex
+from image_prep import ImageEncoder
+from lazy import Lazy, loaded, resolve
+from metrics import MetricsRegistry, configure_logging, log, timed
+from model_cache import FileHasher, ModelCache
+from model_backends import BACKENDS, StubBackend, TransformersBackend
+from near_duplicates import NearDuplicateIndex
+from openrouter_client import OpenRouterClient
+from prefetch import CaptionPrefetcher
+from retry import RetryPolicy
+from upload_ingest import UploadIngestor
+
+data_dir = os.getenv("CAR_DAMAGE_DATA_DIR", "")
+root_folder = os.getenv("CAR_DAMAGE_ROOT", os.path.join(data_dir, "CarData"))
+thumbnail_folder = os.path.join(data_dir, "thumbnails")
+generated_json_file = os.path.join(data_dir, "generated_car_damage_data.json")
+manual_json_file = os.path.join(data_dir, "manual_car_damage_data.json")
+generated_store_file = os.path.join(data_dir, "generated_car_damage_data.jsonl")
+manual_store_file = os.path.join(data_dir, "manual_car_damage_data.jsonl")
+# Names the Flask app used for the generated-caption store; adopted on first use.
+gemma_json_file = os.path.join(data_dir, "gemma_car_damage_data.json")
+gemma_store_file = os.path.join(data_dir, "gemma_car_damage_data.jsonl")
+image_index_db = os.path.join(data_dir, "image_index.db")
+model_cache_db = os.path.join(data_dir, "model_cache.db")
+near_duplicates_db = os.path.join(data_dir, "near_duplicates.db")
+annotation_index_db = os.path.join(data_dir, "annotations.db")
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "openrouter")  # openrouter, openai (local server), transformers or stub
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")  # Add your OpenRouter API key here
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+LOCAL_MODEL_URL = os.getenv("LOCAL_MODEL_URL", "http://127.0.0.1:8080/v1/chat/completions")
+LOCAL_MODEL_API_KEY = os.getenv("LOCAL_MODEL_API_KEY", "")
+SITE_URL = "<YOUR_SITE_URL>"
+SITE_NAME = "<YOUR_SITE_NAME>"
+BACKEND_MODELS = {
+    "openrouter": ("google/gemma-3-12b-it:free", "mistralai/pixtral-12b"),
+    "openai": ("gemma-3-12b-it", "pixtral-12b"),
+    "transformers": ("google/gemma-3-4b-it", "google/gemma-3-4b-it"),
+    "stub": ("stub/gemma", "stub/pixtral"),
+}
+if MODEL_BACKEND not in BACKENDS:
+    raise ValueError(f"MODEL_BACKEND must be one of {', '.join(BACKENDS)}")
+GEMMA_MODEL = os.getenv("GEMMA_MODEL", BACKEND_MODELS[MODEL_BACKEND][0])
+PIXTRAL_MODEL = os.getenv("PIXTRAL_MODEL", BACKEND_MODELS[MODEL_BACKEND][1])
+MODEL_WARM_UP = os.getenv("MODEL_WARM_UP", "0" if MODEL_BACKEND == "openrouter" else "1") == "1"
+MODEL_BATCH_SIZE = 4
+MODEL_BATCH_WINDOW = 0.05
+MODEL_MAX_NEW_TOKENS = 256
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", "0"))
+STUB_LATENCY = float(os.getenv("STUB_LATENCY", "0"))
+CAPTION_PROMPT_VERSION = 1
+EVALUATION_PROMPT_VERSION = 1
+API_TIMEOUT = 60
+API_CONCURRENCY = 8
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 30
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+PREFETCH_DEPTH = 4
+PREFETCH_CONCURRENCY = 4
+GEMMA_BATCH_SIZE = 4
+GEMMA_BATCH_WINDOW = 0.05
+RESCAN_INTERVAL = 30
+LEASE_SECONDS = 600
+PREFETCH_RESERVE_SECONDS = 120
+MODEL_CACHE_MAX_ENTRIES = 200_000
+NEAR_DUPLICATE_CAPTIONS = os.getenv("NEAR_DUPLICATE_CAPTIONS", "1") == "1"
+NEAR_DUPLICATE_DISTANCE = 6
+IMAGE_MAX_EDGE = 1024
+IMAGE_FORMAT = "JPEG"
+IMAGE_QUALITY = 85
+UPLOAD_MAX_FILE_BYTES = 50 * 1024 * 1024
+UPLOAD_WORKERS = 4
+THUMBNAIL_EDGE = 1024
+STRUCTURED_LOGS = os.getenv("STRUCTURED_LOGS", "") == "1"
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+configure_logging(STRUCTURED_LOGS)
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram("car_damage_stage_seconds", "Time spent in each stage of the review pipeline.")
+captions_total = metrics.counter("car_damage_captions_total", "Gemma captions by outcome (model, cache, failed).")
+evaluations_total = metrics.counter("car_damage_evaluations_total", "Pixtral evaluations by outcome (model, cache, unparsed, failed).")
+
+def open_generated_store() -> AnnotationStore:
+    if not os.path.exists(generated_store_file) and os.path.exists(gemma_store_file):
+        os.replace(gemma_store_file, generated_store_file)
+        log(f"Renamed {gemma_store_file} to {generated_store_file}")
+    legacy_json_file = generated_json_file if os.path.exists(generated_json_file) else gemma_json_file
+    return AnnotationStore(generated_store_file, legacy_json_path=legacy_json_file)
+
+generated_store = Lazy(open_generated_store, "generated_store")
+manual_store = Lazy(lambda: AnnotationStore(manual_store_file, legacy_json_path=manual_json_file), "manual_store")
+annotation_index = Lazy(
+    lambda: AnnotationIndex(annotation_index_db, generated_store.path, manual_store.path), "annotation_index"
+)
+
+def create_model_backend():
+    """Build the backend every caption and evaluation request goes through."""
+    if MODEL_BACKEND == "stub":
+        return StubBackend(latency=STUB_LATENCY, max_batch=MODEL_BATCH_SIZE)
+    if MODEL_BACKEND == "transformers":
+        return TransformersBackend(
+            {GEMMA_MODEL: GEMMA_MODEL, PIXTRAL_MODEL: PIXTRAL_MODEL},
+            max_batch=MODEL_BATCH_SIZE,
+            batch_window=MODEL_BATCH_WINDOW,
+            max_new_tokens=MODEL_MAX_NEW_TOKENS,
+            threads=MODEL_THREADS,
+        )
+    local = MODEL_BACKEND == "openai"
+    return OpenRouterClient(
+        LOCAL_MODEL_URL if local else OPENROUTER_URL,
+        LOCAL_MODEL_API_KEY if local else OPENROUTER_API_KEY,
+        SITE_URL,
+        SITE_NAME,
+        timeout=API_TIMEOUT,
+        max_concurrency=API_CONCURRENCY,
+        retry_policy=RetryPolicy(max_retries=MAX_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY),
+        breaker_threshold=BREAKER_FAILURE_THRESHOLD,
+        breaker_reset_timeout=BREAKER_RESET_TIMEOUT,
+    )
+
+model_backend = Lazy(create_model_backend, "model_backend")
+
+model_cache = Lazy(lambda: ModelCache(model_cache_db, max_entries=MODEL_CACHE_MAX_ENTRIES), "model_cache")
+file_hasher = FileHasher()
+near_duplicates = Lazy(
+    lambda: NearDuplicateIndex(near_duplicates_db, max_distance=NEAR_DUPLICATE_DISTANCE), "near_duplicates"
+)
+
+def near_duplicate_cluster(image_path: str, relative_path: str) -> Optional[int]:
+    """Index the image's perceptual hash and return its near-duplicate cluster, or None if disabled."""
+    if not NEAR_DUPLICATE_CAPTIONS:
+        return None
+    try:
+        with stage_seconds.time(stage="near_duplicate_lookup"):
+            return near_duplicates.add_file(image_path, relative_path)
+    except Exception as e:
+        log(f"Error hashing {relative_path} for near-duplicates: {str(e)}", level="error", image=relative_path)
+        return None
+
+def near_duplicate_proposal(relative_path: str) -> Optional[dict]:
+    """The image's near-duplicate group (``size``, ``first_image``) and the ``caption`` proposed for it, if any."""
+    if not NEAR_DUPLICATE_CAPTIONS:
+        return None
+    cluster = near_duplicates.cluster_info(relative_path)
+    if cluster is None:
+        return None
+    return {**cluster, "caption": near_duplicates.caption(near_duplicates.cluster_of(relative_path))}
+
+image_encoder = ImageEncoder(max_edge=IMAGE_MAX_EDGE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY)
+
+@timed(stage_seconds, stage="encode_image")
+def encode_image(image_path: str) -> str:
+    return image_encoder.data_url(image_path)
+
+GEMMA_PROMPT = (
+    "Describe a car’s condition in one paragraph for a car damage dataset, based on the provided image. "
+    "If visible damage exists, detail the type, the specific parts affected, the severity, and notable aspects like "
+    "the damage location. If no damage is visible, state that clearly and include the car’s "
+    "overall condition and any relevant observations. Ensure the description is clear, precise, and avoids assumptions "
+    "beyond the image content. Do not include introductory phrases like 'Here is a description,' 'Based on the image,' "
+    "'This image shows,' or any reference to the image itself and statements like 'further inspection is needed'; focus solely on the car’s state in a direct, standalone manner."
+)
+
+def gemma_payload(image_url: str) -> dict:
+    return {
+        "model": GEMMA_MODEL,
+        "messages": [
+            {"role": "user", "content": [
+                {"type": "text", "text": GEMMA_PROMPT},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]}
+        ]
+    }
+
+@timed(stage_seconds, stage="gemma_caption")
+async def process_image_with_gemma(image_path: str, relative_path: str) -> Optional[str]:
+    try:
+        image_hash = await asyncio.to_thread(file_hasher.hash, image_path)
+    except OSError as e:
+        log(f"Error for {relative_path} with Gemma: {str(e)}", level="error", image=relative_path)
+        captions_total.inc(outcome="failed")
+        return None
+    cache_key = ModelCache.caption_key(image_hash, GEMMA_MODEL, CAPTION_PROMPT_VERSION)
+    cached_caption = await asyncio.to_thread(model_cache.get, "caption", cache_key)
+    if cached_caption is not None:
+        captions_total.inc(outcome="cache")
+        return cached_caption
+    cluster = await asyncio.to_thread(near_duplicate_cluster, image_path, relative_path)
+
+    try:
+        image_url = await asyncio.to_thread(encode_image, image_path)
+        with stage_seconds.time(stage="gemma_request"):
+            result = await model_backend.chat_completion(gemma_payload(image_url))
+        caption = result["choices"][0]["message"]["content"]
+        await asyncio.to_thread(model_cache.put, "caption", cache_key, caption)
+        if cluster is not None:
+            await asyncio.to_thread(near_duplicates.set_caption, cluster, caption)
+        captions_total.inc(outcome="model")
+        return caption
+    except Exception as e:
+        log(f"Error for {relative_path} with Gemma: {str(e)}", level="error", image=relative_path)
+        captions_total.inc(outcome="failed")
+        return None
+
+async def stream_gemma_caption(image_path: str, relative_path: str):
+    """Yield the Gemma caption for an image piece by piece as the model writes it.
+
+    A cached caption comes in one piece. The full caption is cached once the
+    stream ends; errors are raised to the caller.
+    """
+    image_hash = await asyncio.to_thread(file_hasher.hash, image_path)
+    cache_key = ModelCache.caption_key(image_hash, GEMMA_MODEL, CAPTION_PROMPT_VERSION)
+    cached_caption = await asyncio.to_thread(model_cache.get, "caption", cache_key)
+    if cached_caption is not None:
+        captions_total.inc(outcome="cache")
+        yield cached_caption
+        return
+    cluster = await asyncio.to_thread(near_duplicate_cluster, image_path, relative_path)
+
+    image_url = await asyncio.to_thread(encode_image, image_path)
+    pieces = []
+    started = time.perf_counter()
+    with stage_seconds.time(stage="gemma_stream"):
+        async for piece in model_backend.stream_chat_completion(gemma_payload(image_url)):
+            if not pieces:
+                stage_seconds.observe(time.perf_counter() - started, stage="gemma_first_token")
+            pieces.append(piece)
+            yield piece
+    caption = "".join(pieces).strip()
+    if not caption:
+        raise ValueError("Gemma streamed an empty caption")
+    await asyncio.to_thread(model_cache.put, "caption", cache_key, caption)
+    if cluster is not None:
+        await asyncio.to_thread(near_duplicates.set_caption, cluster, caption)
+    captions_total.inc(outcome="model")
+
+async def process_images_with_gemma(items: list, batch_size: Optional[int] = None) -> list:
+    """Caption ``(image_path, relative_path)`` pairs, packing up to ``batch_size`` images per request.
+
+    Cached captions are returned without a request. If a batched reply
+    cannot be split into one caption per image, those images fall back to
+    single-image requests.
+    """
+    batch_size = batch_size or GEMMA_BATCH_SIZE
+    captions: list = [None] * len(items)
+    uncached = []
+    for index, (image_path, relative_path) in enumerate(items):
+        try:
+            image_hash = await asyncio.to_thread(file_hasher.hash, image_path)
+        except OSError as e:
+            log(f"Error for {relative_path} with Gemma: {str(e)}", level="error", image=relative_path)
+            captions_total.inc(outcome="failed")
+            continue
+        cache_key = ModelCache.caption_key(image_hash, GEMMA_MODEL, CAPTION_PROMPT_VERSION)
+        captions[index] = await asyncio.to_thread(model_cache.get, "caption", cache_key)
+        if captions[index] is None:
+            uncached.append((index, image_path, relative_path, cache_key))
+        else:
+            captions_total.inc(outcome="cache")
+
+    clusters = await asyncio.to_thread(
+        lambda: {index: near_duplicate_cluster(path, relative) for index, path, relative, _ in uncached}
+    )
+    async def caption_chunk(chunk: list):
+        if len(chunk) > 1:
+            try:
+                image_urls = await asyncio.gather(*(asyncio.to_thread(encode_image, path) for _, path, _, _ in chunk))
+                with stage_seconds.time(stage="gemma_batch_request"):
+                    result = await model_backend.chat_completion(build_batch_payload(GEMMA_MODEL, GEMMA_PROMPT, image_urls))
+                parsed = parse_batch_reply(result["choices"][0]["message"]["content"], len(chunk))
+            except Exception as e:
+                log(f"Error for batch of {len(chunk)} images with Gemma: {str(e)}", level="error")
+                parsed = None
+            if parsed is not None:
+                for (index, _, _, cache_key), caption in zip(chunk, parsed):
+                    await asyncio.to_thread(model_cache.put, "caption", cache_key, caption)
+                    if clusters[index] is not None:
+                        await asyncio.to_thread(near_duplicates.set_caption, clusters[index], caption)
+                    captions[index] = caption
+                captions_total.inc(len(parsed), outcome="model")
+                return
+            log(f"Falling back to single-image Gemma requests for {len(chunk)} images", level="warning")
+        results = await asyncio.gather(*(process_image_with_gemma(path, relative) for _, path, relative, _ in chunk))
+        for (index, _, _, _), caption in zip(chunk, results):
+            captions[index] = caption
+
+    await asyncio.gather(*(
+        caption_chunk(uncached[start:start + batch_size]) for start in range(0, len(uncached), batch_size)
+    ))
+    return captions
+
+caption_batcher = CaptionBatcher(process_images_with_gemma, max_batch=GEMMA_BATCH_SIZE, window=GEMMA_BATCH_WINDOW)
+
+@timed(stage_seconds, stage="pixtral_evaluation")
+async def evaluate_with_pixtral(image_path: str, caption: str, image_url: Optional[str] = None) -> dict:
+    try:
+        image_hash = await asyncio.to_thread(file_hasher.hash, image_path)
+    except OSError as e:
+        log(f"Error evaluating with Pixtral: {str(e)}", level="error")
+        evaluations_total.inc(outcome="failed")
+        return {"score": None, "explanation": "Evaluation failed"}
+    cache_key = ModelCache.evaluation_key(image_hash, caption, PIXTRAL_MODEL, EVALUATION_PROMPT_VERSION)
+    cached_evaluation = await asyncio.to_thread(model_cache.get, "evaluation", cache_key)
+    if cached_evaluation is not None:
+        evaluations_total.inc(outcome="cache")
+        return cached_evaluation
+
+    try:
+        if image_url is None:
+            image_url = await asyncio.to_thread(encode_image, image_path)
+        evaluation_prompt = (
+            f"Evaluate the following description of a car’s condition based on the provided image. "
+            f"Score it out of 5 (1 being very inaccurate, 5 being very accurate) based on how well it describes the car’s visible condition. "
+            f"Provide a brief explanation for your score. Return your response in this format: 'Score: X/5 - Explanation: [your explanation]'. "
+            f"The description to evaluate is: '{caption}'"
+        )
+
+        payload = {
+            "model": PIXTRAL_MODEL,
+            "messages": [
+                {"role": "user", "content": [
+                    {"type": "text", "text": evaluation_prompt},
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                ]}
+            ]
+        }
+
+        with stage_seconds.time(stage="pixtral_request"):
+            result = await model_backend.chat_completion(payload)
+        response_text = result["choices"][0]["message"]["content"]
+        
+        try:
+            score_line = response_text.split(' - ')[0]
+            score = int(score_line.split(':')[1].split('/')[0].strip())
+            explanation = response_text.split(' - Explanation: ')[1].strip()
+            evaluation = {"score": score, "explanation": explanation}
+            await asyncio.to_thread(model_cache.put, "evaluation", cache_key, evaluation)
+            evaluations_total.inc(outcome="model")
+            return evaluation
+        except Exception as e:
+            log(f"Error parsing Pixtral response: {e}", level="error")
+            evaluations_total.inc(outcome="unparsed")
+            return {"score": None, "explanation": response_text}
+    except Exception as e:
+        log(f"Error evaluating with Pixtral: {str(e)}", level="error")
+        evaluations_total.inc(outcome="failed")
+        return {"score": None, "explanation": "Evaluation failed"}
+
+async def saved_evaluation(full_image_path: str, caption: Optional[str], score: Optional[int],
+                           explanation: Optional[str]) -> dict:
+    """The evaluation to store with a saved caption.
+
+    The cached Pixtral evaluation of exactly this caption wins over what the
+    client sent, which may belong to an earlier edit of the caption.
+    """
+    if caption:
+        try:
+            image_hash = await asyncio.to_thread(file_hasher.hash, full_image_path)
+        except OSError:
+            image_hash = None
+        if image_hash is not None:
+            cache_key = ModelCache.evaluation_key(image_hash, caption, PIXTRAL_MODEL, EVALUATION_PROMPT_VERSION)
+            cached_evaluation = await asyncio.to_thread(model_cache.get, "evaluation", cache_key)
+            if cached_evaluation is not None:
+                return cached_evaluation
+    return {"score": score, "explanation": explanation}
+
+image_index = Lazy(lambda: ImageIndex(root_folder, image_index_db, rescan_interval=RESCAN_INTERVAL), "image_index")
+
+@timed(stage_seconds, stage="index_sync")
+def sync_image_index():
+    image_index.refresh(force=True)
+
+    def reconcile():
+        with stage_seconds.time(stage="store_load"):
+            processed = generated_store.images()
+        image_index.sync_processed(processed)
+
+    # Appends (from any process) wait until the index matches the store. Images claimed for an append
+    # that has not landed yet stay claimed (see ImageIndex.sync_processed), so nobody else gets them.
+    generated_store.exclusive(reconcile)
+
+@timed(stage_seconds, stage="get_all_images")
+def get_all_images(limit: int = 1):
+    """Pending images in review order, reserved for this process so other server processes skip them."""
+    image_index.refresh()
+    reclaimed = image_index.reclaim_expired()
+    if reclaimed:
+        log(f"Reclaimed {reclaimed} expired image leases")
+    return image_index.reserve(limit, WORKER_ID, PREFETCH_RESERVE_SECONDS)
+
+def lease_image(relative_path: str, reviewer: str) -> bool:
+    return image_index.lease(relative_path, reviewer, LEASE_SECONDS)
+
+upload_ingestor = Lazy(lambda: UploadIngestor(
+    root_folder,
+    thumbnail_folder,
+    image_index,
+    max_file_bytes=UPLOAD_MAX_FILE_BYTES,
+    thumbnail_edge=THUMBNAIL_EDGE,
+    workers=UPLOAD_WORKERS,
+    near_duplicates=near_duplicates if NEAR_DUPLICATE_CAPTIONS else None,
+), "upload_ingestor")
+
+prefetcher = CaptionPrefetcher(
+    get_all_images,
+    caption_batcher.caption if GEMMA_BATCH_SIZE > 1 else process_image_with_gemma,
+    lambda relative_path, reviewer: asyncio.to_thread(lease_image, relative_path, reviewer),
+    lambda relative_path, reviewer: asyncio.to_thread(image_index.release, relative_path, reviewer),
+    depth=PREFETCH_DEPTH,
+    max_in_flight=PREFETCH_CONCURRENCY,
+)
+
+metrics.callback("car_damage_images", "Images in the index by state.", lambda: image_index.counts(), label="state")
+metrics.callback("car_damage_prefetch_ready", "Prefetched captions waiting for a reviewer.", lambda: prefetcher.stats()["queue_depth"])
+metrics.callback("car_damage_prefetch_in_flight", "Prefetch captions being generated.", lambda: prefetcher.stats()["in_flight"])
+metrics.callback("car_damage_prefetch_total", "Review requests served from (hit) or missing (miss) the prefetch queue.",
+                 lambda: {"hit": prefetcher.hits, "miss": prefetcher.misses}, kind="counter", label="result")
+metrics.callback("car_damage_api_requests_total", "Model backend call events (requests, successes, retries, failures, ...).",
+                 lambda: dict(model_backend.counters), kind="counter", label="event")
+metrics.callback("car_damage_api_in_flight", "Model requests in flight, by model (HTTP) or queued/running (in-process).",
+                 lambda: model_backend.in_flight(), label="model")
+metrics.callback("car_damage_circuit_open", "1 while a model's circuit breaker is not closed.",
+                 lambda: {model: int(stats["state"] != "closed") for model, stats in model_backend.stats()["breakers"].items()},
+                 label="model")
+metrics.callback("car_damage_model_cache_entries", "Entries in the model response cache.", lambda: model_cache.stats()["entries"])
+metrics.callback("car_damage_model_cache_hits_total", "Model cache hits by kind.",
+                 lambda: {kind: stats["hits"] for kind, stats in model_cache.stats()["kinds"].items()}, kind="counter", label="kind")
+metrics.callback("car_damage_model_cache_misses_total", "Model cache misses by kind.",
+                 lambda: {kind: stats["misses"] for kind, stats in model_cache.stats()["kinds"].items()}, kind="counter", label="kind")
+metrics.callback("car_damage_near_duplicate_images", "Perceptual-hash index size: hashed images and clusters.",
+                 lambda: {key: value for key, value in near_duplicates.stats().items() if key in ("images", "clusters")}
+                 if loaded(near_duplicates) else {},
+                 label="kind")
+metrics.callback("car_damage_image_encoding_bytes_total", "Image bytes before (in) and after (out) re-encoding.",
+                 lambda: {"in": image_encoder.bytes_in, "out": image_encoder.bytes_out}, kind="counter", label="direction")
+
+startup_task: Optional[asyncio.Task] = None
+
+def prepare():
+    """Bring this process up to date with the image tree and the stores."""
+    with stage_seconds.time(stage="startup"):
+        sync_image_index()
+        annotation_index.sync()
+        if NEAR_DUPLICATE_CAPTIONS:
+            resolve(near_duplicates)
+
+def prepared(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        log(f"Error preparing the indexes: {str(task.exception())}", level="error")
+    prefetcher.kick()
+
+async def start():
+    """Start serving. The index sync runs in the background; ``index_ready`` waits for it only when it must."""
+    global startup_task
+    if not os.path.exists(root_folder):
+        raise FileNotFoundError(f"The folder {root_folder} does not exist.")
+    os.makedirs(thumbnail_folder, exist_ok=True)
+    startup_task = asyncio.create_task(asyncio.to_thread(prepare))
+    startup_task.add_done_callback(prepared)
+    if MODEL_WARM_UP:
+        await model_backend.warm_up(sorted({GEMMA_MODEL, PIXTRAL_MODEL}))
+    prefetcher.start()
+
+async def index_ready():
+    """Wait for the startup sync if the image index has never been built. A built one is served from right away."""
+    if startup_task is not None and not startup_task.done() and not await asyncio.to_thread(image_index.scanned):
+        await asyncio.shield(startup_task)
+
+async def stop():
+    if startup_task is not None:
+        await asyncio.wait([startup_task])
+    await prefetcher.stop()
+    if loaded(model_backend):
+        await model_backend.close()
+    close_storage()
+
+def close_storage():
+    """Close the stores and indexes this process opened."""
+    for resource in (upload_ingestor, image_index, model_cache, near_duplicates, annotation_index,
+                     generated_store, manual_store):
+        if loaded(resource):
+            resource.close()
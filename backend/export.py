@@ -0,0 +1,211 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from typing import Callable, Iterable, Iterator, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_FIELDS = ["image", "caption", "created_at", "score", "explanation"]
+EXPORT_FORMATS = ("json", "jsonl", "csv", "parquet")
+ROWS_PER_FLUSH = 1000
+
+
+class ExportError(Exception):
+    pass
+
+
+class _ZipSink:
+    """Write-only file object that buffers ZIP output until it is taken."""
+
+    def __init__(self):
+        self._buffer = io.BytesIO()
+
+    def write(self, data) -> int:
+        return self._buffer.write(data)
+
+    def flush(self):
+        pass
+
+    @property
+    def size(self) -> int:
+        return self._buffer.tell()
+
+    def take(self) -> bytes:
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def stream_zip(entries: Iterable, flush_bytes: int = 256 * 1024) -> Iterator[bytes]:
+    """Yield a ZIP archive chunk by chunk.
+
+    ``entries`` yields ``(name, write, compress)`` where ``write(file)`` is a
+    generator that writes the entry to ``file`` and yields whenever it is a
+    good time to hand buffered output to the client. The sink is not
+    seekable, so ``zipfile`` uses data descriptors and nothing is buffered
+    beyond ``flush_bytes`` plus one write.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, write, compress in entries:
+            info = zipfile.ZipInfo(name)
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            with archive.open(info, "w", force_zip64=True) as entry:
+                for _ in write(entry):
+                    if sink.size >= flush_bytes:
+                        yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+
+def record_filter(since: Optional[float] = None, folder: Optional[str] = None,
+                  images: Optional[set] = None) -> Callable[[dict], bool]:
+    prefix = folder.strip("/") + "/" if folder else None
+
+    def keep(record: dict) -> bool:
+        if since is not None and (record.get("created_at") or 0) < since:
+            return False
+        if prefix is not None and not record.get("image", "").startswith(prefix):
+            return False
+        if images is not None and record.get("image") not in images:
+            return False
+        return True
+
+    return keep
+
+
+def write_json_array(records: Iterable[dict]):
+    def write(file):
+        file.write(b"[")
+        for index, record in enumerate(records):
+            file.write(b",\n    " if index else b"\n    ")
+            file.write(json.dumps(record).encode("utf-8"))
+            if index % ROWS_PER_FLUSH == 0:
+                yield
+        file.write(b"\n]")
+        yield
+    return write
+
+
+def write_jsonl(records: Iterable[dict]):
+    def write(file):
+        for index, record in enumerate(records, 1):
+            file.write(json.dumps(record).encode("utf-8") + b"\n")
+            if index % ROWS_PER_FLUSH == 0:
+                yield
+        yield
+    return write
+
+
+def write_csv(records: Iterable[dict], fields: list):
+    def write(file):
+        text = io.TextIOWrapper(file, encoding="utf-8", newline="", write_through=True)
+        writer = csv.DictWriter(text, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for index, record in enumerate(records, 1):
+            writer.writerow(record)
+            if index % ROWS_PER_FLUSH == 0:
+                yield
+        text.detach()
+        yield
+    return write
+
+
+def parquet_schema(fields: list):
+    # Fixed types, so a batch where a column is all null still matches the file schema.
+    types = {"created_at": pa.float64(), "score": pa.int64()}
+    return pa.schema([(field, types.get(field, pa.string())) for field in fields])
+
+
+def write_parquet(records: Iterable[dict], fields: list):
+    def write(file):
+        schema = parquet_schema(fields)
+        writer = None
+        batch: list = []
+
+        def flush_batch():
+            nonlocal writer
+            table = pa.Table.from_pylist([{field: row.get(field) for field in fields} for row in batch], schema=schema)
+            if writer is None:
+                writer = pq.ParquetWriter(pa.PythonFile(file, mode="w"), schema)
+            writer.write_table(table)
+            batch.clear()
+
+        for record in records:
+            batch.append(record)
+            if len(batch) >= ROWS_PER_FLUSH:
+                flush_batch()
+                yield
+        if batch or writer is None:
+            if not batch:
+                writer = pq.ParquetWriter(pa.PythonFile(file, mode="w"), schema)
+            else:
+                flush_batch()
+        writer.close()
+        yield
+    return write
+
+
+def write_file(path: str):
+    def write(file):
+        with open(path, "rb") as source:
+            for chunk in iter(lambda: source.read(1 << 20), b""):
+                file.write(chunk)
+                yield
+    return write
+
+
+def contained_path(root: str, relative_path: str) -> Optional[str]:
+    """Resolve ``relative_path`` under the real path ``root``, or None if it points outside it."""
+    path = os.path.realpath(os.path.join(root, relative_path))
+    return path if path.startswith(root + os.sep) else None
+
+
+def export_entries(stores: list, export_format: str, keep: Callable[[dict], bool],
+                   root_folder: Optional[str] = None, fields: Optional[list] = None):
+    """Build ``stream_zip`` entries for ``stores``, a list of ``(name, store)`` pairs.
+
+    When ``root_folder`` is given, the images referenced by the exported
+    records are added under ``images/``; references that resolve outside
+    ``root_folder`` are skipped.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"Unsupported format {export_format!r}; use one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet" and pa is None:
+        raise ExportError("Parquet export requires pyarrow")
+    fields = fields or EXPORT_FIELDS
+
+    for name, store in stores:
+        records = (record for record in store if keep(record))
+        if export_format == "json":
+            yield f"{name}.json", write_json_array(records), True
+        elif export_format == "jsonl":
+            yield f"{name}.jsonl", write_jsonl(records), True
+        elif export_format == "csv":
+            yield f"{name}.csv", write_csv(records, fields), True
+        else:
+            yield f"{name}.parquet", write_parquet(records, fields), False
+
+    if root_folder is not None:
+        root = os.path.realpath(root_folder)
+        seen = set()
+        for _, store in stores:
+            for record in store:
+                image = record.get("image")
+                if not image or not keep(record):
+                    continue
+                image_path = contained_path(root, image)
+                if image_path is None or image_path in seen:
+                    continue
+                seen.add(image_path)
+                if os.path.isfile(image_path):
+                    relative_path = os.path.relpath(image_path, root).replace(os.sep, "/")
+                    yield f"images/{relative_path}", write_file(image_path), False
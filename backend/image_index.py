@@ -0,0 +1,508 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SCAN_COMMIT_INTERVAL = 0.25
+SHARED_COUNTS_MAX_AGE = 2.0
+# A claim older than this whose entry never reached the store is taken to belong to a process that died.
+CLAIM_TIMEOUT = 600.0
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def scan_lock(path: str, wait: bool):
+    """Hold an exclusive lock on ``path`` across processes. Yields False if ``wait`` is off and it is taken."""
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class ImageIndex:
+    """Persistent SQLite index of the images under ``root_folder``.
+
+    Each image row stores its path, mtime, size and processed state. Folders
+    are stored with their mtime so ``refresh`` only re-lists directories whose
+    contents changed since the last scan. Rows keep their insertion id, which
+    follows the walk order and is used as the review order.
+
+    Pending images can be leased to a reviewer for a number of seconds so
+    concurrent reviewers never get the same image. A reviewer holds at most
+    one lease; expired leases are ignored and cleared by ``reclaim_expired``.
+    Lease times are wall-clock so several processes can share the database:
+    only one of them rescans at a time, committing every few hundred
+    milliseconds so the others are never blocked for long, and cached counts
+    are dropped whenever another process commits. The rescan runs on its own
+    connection, so calls from other threads do not wait for it either.
+    """
+
+    def __init__(self, root_folder: str, db_path: str, rescan_interval: float = 30):
+        self.root_folder = root_folder
+        self.db_path = db_path
+        self.rescan_interval = rescan_interval
+        self.last_scan = 0.0
+        self._lock = threading.RLock()
+        self._scan_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                relative_path TEXT NOT NULL UNIQUE,
+                folder TEXT NOT NULL,
+                mtime REAL,
+                size INTEGER,
+                processed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS images_folder ON images(folder);
+            CREATE INDEX IF NOT EXISTS images_pending ON images(processed, id);
+            CREATE TABLE IF NOT EXISTS folders (
+                relative_path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime REAL
+            );
+            CREATE INDEX IF NOT EXISTS folders_parent ON folders(parent);
+            """
+        )
+        with self._conn:
+            # Under the write lock, so processes starting together do not both add a column.
+            self._conn.execute("BEGIN IMMEDIATE")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(images)")}
+            if "sha256" not in columns:
+                self._conn.execute("ALTER TABLE images ADD COLUMN sha256 TEXT")
+            if "leased_by" not in columns:
+                self._conn.execute("ALTER TABLE images ADD COLUMN leased_by TEXT")
+                self._conn.execute("ALTER TABLE images ADD COLUMN lease_expires REAL")
+            if "reserved_by" not in columns:
+                self._conn.execute("ALTER TABLE images ADD COLUMN reserved_by TEXT")
+                self._conn.execute("ALTER TABLE images ADD COLUMN reserve_expires REAL")
+            if "claimed_at" not in columns:
+                self._conn.execute("ALTER TABLE images ADD COLUMN claimed_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS images_sha256 ON images(sha256)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS images_size ON images(size)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS images_leased_by ON images(leased_by)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS images_lease_expires ON images(lease_expires)")
+        self._scan_conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._counts: Optional[dict] = None
+        self._data_version = None
+        self._counted_at = 0.0
+
+    def close(self):
+        with self._scan_lock:
+            self._scan_conn.close()
+        with self._lock:
+            self._conn.close()
+
+    def refresh(self, force: bool = False) -> int:
+        """Rescan folders whose mtime changed. Returns the number of re-listed folders.
+
+        If another thread or process is already rescanning, a non-forced
+        refresh returns 0 at once and a forced one waits for it to finish first.
+        """
+        if not self._scan_lock.acquire(blocking=force):
+            return 0
+        try:
+            if not force and time.monotonic() - self.last_scan < self.rescan_interval:
+                return 0
+            with scan_lock(f"{self.db_path}.scan.lock", wait=force) as acquired:
+                if not acquired:
+                    self.last_scan = time.monotonic()
+                    return 0
+                changed = self._scan()
+            if changed:
+                with self._lock:
+                    self._counts = None
+            self.last_scan = time.monotonic()
+            return changed
+        finally:
+            self._scan_lock.release()
+
+    def scanned(self) -> bool:
+        """Whether any scan has recorded a folder yet, i.e. the index can be served from."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM folders WHERE mtime IS NOT NULL LIMIT 1").fetchone() is not None
+
+    def _scan(self) -> int:
+        known = dict(self._scan_conn.execute("SELECT relative_path, mtime FROM folders"))
+        changed = 0
+        stack = [""]
+        committed = time.monotonic()
+        try:
+            while stack:
+                folder = stack.pop()
+                absolute = os.path.join(self.root_folder, folder) if folder else self.root_folder
+                try:
+                    mtime = os.stat(absolute).st_mtime
+                except FileNotFoundError:
+                    changed += 1
+                    self._remove_folder(folder)
+                    continue
+                if known.get(folder) == mtime:
+                    stack.extend(
+                        row[0] for row in self._scan_conn.execute(
+                            "SELECT relative_path FROM folders WHERE parent = ?", (folder,)
+                        )
+                    )
+                    continue
+                changed += 1
+                stack.extend(self._scan_folder(folder, absolute, mtime))
+                # Each folder is recorded with its files, so a scan cut short resumes where it stopped.
+                if time.monotonic() - committed > SCAN_COMMIT_INTERVAL:
+                    self._scan_conn.commit()
+                    committed = time.monotonic()
+            self._scan_conn.commit()
+        except BaseException:
+            self._scan_conn.rollback()
+            raise
+        return changed
+
+    def _scan_folder(self, folder: str, absolute: str, mtime: float) -> list:
+        files = []
+        subfolders = []
+        with os.scandir(absolute) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                relative_path = f"{folder}/{entry.name}" if folder else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(relative_path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    files.append((relative_path, folder, stat.st_mtime, stat.st_size))
+
+        self._scan_conn.executemany(
+            """
+            INSERT INTO images (relative_path, folder, mtime, size) VALUES (?, ?, ?, ?)
+            ON CONFLICT(relative_path) DO UPDATE SET
+                folder = excluded.folder, mtime = excluded.mtime, size = excluded.size,
+                sha256 = CASE WHEN mtime IS excluded.mtime AND size IS excluded.size THEN sha256 END
+            """,
+            files,
+        )
+        present = {row[0] for row in files}
+        stale = [
+            (row[0],) for row in self._scan_conn.execute(
+                "SELECT relative_path FROM images WHERE folder = ? AND mtime IS NOT NULL", (folder,)
+            )
+            if row[0] not in present
+        ]
+        self._scan_conn.executemany("DELETE FROM images WHERE relative_path = ?", stale)
+
+        for (child,) in self._scan_conn.execute(
+            "SELECT relative_path FROM folders WHERE parent = ?", (folder,)
+        ).fetchall():
+            if child not in subfolders:
+                self._remove_folder(child)
+        self._scan_conn.executemany(
+            "INSERT OR IGNORE INTO folders (relative_path, parent, mtime) VALUES (?, ?, NULL)",
+            [(child, folder) for child in subfolders],
+        )
+        self._scan_conn.execute(
+            "INSERT INTO folders (relative_path, parent, mtime) VALUES (?, ?, ?) "
+            "ON CONFLICT(relative_path) DO UPDATE SET mtime = excluded.mtime",
+            (folder, folder.rpartition("/")[0] if folder else None, mtime),
+        )
+        return subfolders
+
+    def _remove_folder(self, folder: str):
+        self._scan_conn.execute(
+            "DELETE FROM images WHERE mtime IS NOT NULL AND (folder = ? OR (folder >= ? AND folder < ?))",
+            (folder, f"{folder}/", f"{folder}0"),
+        )
+        self._scan_conn.execute(
+            "DELETE FROM folders WHERE relative_path = ? OR (relative_path >= ? AND relative_path < ?)",
+            (folder, f"{folder}/", f"{folder}0"),
+        )
+
+    def add_file(self, relative_path: str, sha256: Optional[str] = None):
+        """Register a single file, e.g. one just written by an upload."""
+        if not relative_path.lower().endswith(IMAGE_EXTENSIONS):
+            return
+        absolute = os.path.join(self.root_folder, relative_path)
+        stat = os.stat(absolute)
+        folder = relative_path.rpartition("/")[0]
+        with self._lock, self._conn:
+            previous = self._row_state(relative_path)
+            self._conn.execute(
+                """
+                INSERT INTO images (relative_path, folder, mtime, size, sha256) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(relative_path) DO UPDATE SET
+                    mtime = excluded.mtime, size = excluded.size, sha256 = excluded.sha256
+                """,
+                (relative_path, folder, stat.st_mtime, stat.st_size, sha256),
+            )
+            self._adjust_counts(previous, self._row_state(relative_path))
+
+    def find_by_hash(self, sha256: str, size: Optional[int] = None) -> Optional[str]:
+        """Return an indexed image with content hash ``sha256``.
+
+        Scanned files are not hashed up front. Given the file ``size``, the
+        unhashed images of exactly that size are hashed now (and their
+        hashes kept), so a copy of any indexed image is found.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT relative_path FROM images WHERE sha256 = ? AND mtime IS NOT NULL LIMIT 1", (sha256,)
+            ).fetchone()
+            if row or size is None:
+                return row[0] if row else None
+            candidates = self._conn.execute(
+                "SELECT relative_path, mtime FROM images WHERE size = ? AND sha256 IS NULL AND mtime IS NOT NULL",
+                (size,),
+            ).fetchall()
+        found = None
+        for relative_path, mtime in candidates:
+            try:
+                content_hash = file_sha256(os.path.join(self.root_folder, relative_path))
+            except OSError:
+                continue
+            with self._lock, self._conn:
+                # Only keep the hash if the file was not replaced since it was indexed.
+                self._conn.execute(
+                    "UPDATE images SET sha256 = ? WHERE relative_path = ? AND mtime = ? AND size = ?",
+                    (content_hash, relative_path, mtime, size),
+                )
+            if content_hash == sha256:
+                found = relative_path
+                break
+        return found
+
+    def mark_processed(self, relative_path: str, processed: bool = True):
+        with self._lock, self._conn:
+            previous = self._row_state(relative_path)
+            self._conn.execute(
+                """
+                INSERT INTO images (relative_path, folder, processed) VALUES (?, ?, ?)
+                ON CONFLICT(relative_path) DO UPDATE SET
+                    processed = excluded.processed, leased_by = NULL, lease_expires = NULL, claimed_at = NULL
+                """,
+                (relative_path, relative_path.rpartition("/")[0], int(processed)),
+            )
+            self._adjust_counts(previous, self._row_state(relative_path))
+
+    def claim(self, relative_path: str, reviewer: str) -> bool:
+        """Mark a pending image processed for ``reviewer`` in one step.
+
+        Fails if the image is already processed, gone, or leased to someone
+        else, so of several concurrent saves exactly one gets the image. The
+        claim is recorded until ``sync_processed`` finds the image's entry in
+        the store (or ``mark_processed`` settles it), so a sync that runs
+        before the entry is written keeps the image processed.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            claimed = self._conn.execute(
+                """
+                UPDATE images SET processed = 1, leased_by = NULL, lease_expires = NULL, claimed_at = ?
+                WHERE relative_path = ? AND processed = 0 AND mtime IS NOT NULL
+                    AND (leased_by IS NULL OR leased_by = ? OR lease_expires <= ?)
+                """,
+                (now, relative_path, reviewer, now),
+            ).rowcount == 1
+            if claimed:
+                self._adjust_counts("pending", "done")
+        return claimed
+
+    def is_indexed(self, relative_path: str) -> bool:
+        with self._lock:
+            return self._row_state(relative_path) is not None
+
+    def is_processed(self, relative_path: str) -> bool:
+        with self._lock:
+            return self._row_state(relative_path) == "done"
+
+    def lease(self, relative_path: str, reviewer: str, seconds: float) -> bool:
+        """Lease a pending image to ``reviewer`` (or renew their lease).
+
+        Fails if the image is done, gone, or leased to someone else. Any other
+        lease ``reviewer`` held is released.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            leased = self._conn.execute(
+                """
+                UPDATE images SET leased_by = ?, lease_expires = ?
+                WHERE relative_path = ? AND processed = 0 AND mtime IS NOT NULL
+                    AND (leased_by IS NULL OR leased_by = ? OR lease_expires <= ?)
+                """,
+                (reviewer, now + seconds, relative_path, reviewer, now),
+            ).rowcount == 1
+            if leased:
+                self._conn.execute(
+                    "UPDATE images SET leased_by = NULL, lease_expires = NULL "
+                    "WHERE leased_by = ? AND relative_path != ?",
+                    (reviewer, relative_path),
+                )
+        return leased
+
+    def release(self, relative_path: str, reviewer: Optional[str] = None):
+        with self._lock, self._conn:
+            if reviewer is None:
+                self._conn.execute(
+                    "UPDATE images SET leased_by = NULL, lease_expires = NULL WHERE relative_path = ?",
+                    (relative_path,),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE images SET leased_by = NULL, lease_expires = NULL "
+                    "WHERE relative_path = ? AND leased_by = ?",
+                    (relative_path, reviewer),
+                )
+
+    def lease_holder(self, relative_path: str) -> Optional[str]:
+        """Return the reviewer holding an unexpired lease on ``relative_path``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT leased_by FROM images WHERE relative_path = ? AND lease_expires > ?",
+                (relative_path, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def active_lease(self, reviewer: str) -> Optional[tuple]:
+        """Return the ``(image_path, relative_path)`` currently leased to ``reviewer``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT relative_path FROM images WHERE leased_by = ? AND lease_expires > ? "
+                "AND processed = 0 AND mtime IS NOT NULL LIMIT 1",
+                (reviewer, time.time()),
+            ).fetchone()
+        return (os.path.join(self.root_folder, row[0]), row[0]) if row else None
+
+    def reclaim_expired(self) -> int:
+        """Clear expired leases. Returns how many were reclaimed."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE images SET leased_by = NULL, lease_expires = NULL WHERE lease_expires <= ?",
+                (time.time(),),
+            ).rowcount
+
+    def _row_state(self, relative_path: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT processed, mtime FROM images WHERE relative_path = ?", (relative_path,)
+        ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        return "done" if row[0] else "pending"
+
+    def _adjust_counts(self, previous: Optional[str], current: Optional[str]):
+        if self._counts is None or previous == current:
+            return
+        if previous is not None:
+            self._counts[previous] -= 1
+        if current is not None:
+            self._counts[current] += 1
+
+    def sync_processed(self, processed_paths: Iterable[str]):
+        """Reset processed state so exactly ``processed_paths`` are marked done.
+
+        Images claimed less than ``CLAIM_TIMEOUT`` seconds ago stay done too:
+        their entries may not have been written yet.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE images SET processed = 0, claimed_at = NULL WHERE claimed_at IS NULL OR claimed_at <= ?",
+                (time.time() - CLAIM_TIMEOUT,),
+            )
+            self._conn.executemany(
+                """
+                INSERT INTO images (relative_path, folder, processed) VALUES (?, ?, 1)
+                ON CONFLICT(relative_path) DO UPDATE SET
+                    processed = 1, leased_by = NULL, lease_expires = NULL, claimed_at = NULL
+                """,
+                ((path, path.rpartition("/")[0]) for path in processed_paths),
+            )
+            self._counts = None
+
+    def pending(self, limit: int) -> list:
+        """Return up to ``limit`` unprocessed, unleased ``(image_path, relative_path)`` pairs in review order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT relative_path FROM images WHERE processed = 0 AND mtime IS NOT NULL "
+                "AND (lease_expires IS NULL OR lease_expires <= ?) ORDER BY id LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [(os.path.join(self.root_folder, row[0]), row[0]) for row in rows]
+
+    def reserve(self, limit: int, owner: str, seconds: float) -> list:
+        """Like ``pending``, but skip images another ``owner`` reserved and reserve the rest for ``seconds``.
+
+        Server processes that prefetch captions each reserve what they
+        prefetch, so two of them never caption the same image at once.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "SELECT relative_path FROM images WHERE processed = 0 AND mtime IS NOT NULL "
+                "AND (lease_expires IS NULL OR lease_expires <= ?) "
+                "AND (reserved_by IS NULL OR reserved_by = ? OR reserve_expires <= ?) ORDER BY id LIMIT ?",
+                (now, owner, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE images SET reserved_by = ?, reserve_expires = ? WHERE relative_path = ?",
+                [(owner, now + seconds, row[0]) for row in rows],
+            )
+        return [(os.path.join(self.root_folder, row[0]), row[0]) for row in rows]
+
+    def iter_pending(self, page_size: int = 1000):
+        """Yield every unprocessed, unleased ``(image_path, relative_path)`` pair, one page at a time."""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, relative_path FROM images WHERE processed = 0 AND mtime IS NOT NULL "
+                    "AND (lease_expires IS NULL OR lease_expires <= ?) AND id > ? ORDER BY id LIMIT ?",
+                    (time.time(), last_id, page_size),
+                ).fetchall()
+            if not rows:
+                return
+            for _, relative_path in rows:
+                yield os.path.join(self.root_folder, relative_path), relative_path
+            last_id = rows[-1][0]
+
+    def counts(self) -> dict:
+        """Return ``pending`` (unleased), ``leased`` and ``done`` image counts."""
+        with self._lock:
+            # data_version changes when another connection (e.g. another server process) commits;
+            # their changes are recounted at most every SHARED_COUNTS_MAX_AGE seconds.
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            stale = data_version != self._data_version and time.monotonic() - self._counted_at > SHARED_COUNTS_MAX_AGE
+            if self._counts is None or stale:
+                self._data_version = data_version
+                self._counted_at = time.monotonic()
+                counts = {"pending": 0, "done": 0}
+                for processed, count in self._conn.execute(
+                    "SELECT processed, COUNT(*) FROM images WHERE mtime IS NOT NULL GROUP BY processed"
+                ):
+                    counts["done" if processed else "pending"] = count
+                self._counts = counts
+            leased = self._conn.execute(
+                "SELECT COUNT(*) FROM images WHERE lease_expires > ? AND processed = 0 AND mtime IS NOT NULL",
+                (time.time(),),
+            ).fetchone()[0]
+            return {"pending": self._counts["pending"] - leased, "leased": leased, "done": self._counts["done"]}
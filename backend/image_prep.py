@@ -0,0 +1,106 @@
+import base64
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from metrics import log
+
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+class ImageEncoder:
+    """Downscales and re-encodes images before they are sent to the vision models.
+
+    Images are resized so their longest edge is at most ``max_edge`` and
+    re-encoded as ``image_format`` at ``quality``. If the original file is
+    already small enough and smaller than the re-encoded version, it is sent
+    as-is. Encoded payloads are kept in an LRU cache bounded by
+    ``cache_bytes`` and keyed on path, mtime and size.
+    """
+
+    def __init__(self, max_edge: int = 1024, image_format: str = "JPEG", quality: int = 85,
+                 cache_bytes: int = 64 * 1024 * 1024):
+        self.max_edge = max_edge
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self.encoded = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_seconds = 0.0
+
+    def encode(self, image_path: str) -> tuple:
+        """Return ``(mime_type, base64_payload)`` for ``image_path``."""
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._cache[key]
+
+        started = time.perf_counter()
+        with open(image_path, "rb") as img_file:
+            original = img_file.read()
+        mime_type, data = self._reencode(image_path, original)
+        payload = (mime_type, base64.b64encode(data).decode("utf-8"))
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.encoded += 1
+            self.bytes_in += len(original)
+            self.bytes_out += len(data)
+            self.encode_seconds += elapsed
+            if key not in self._cache:
+                self._cache[key] = payload
+                self._cached_bytes += len(payload[1])
+                while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(evicted[1])
+        return payload
+
+    def data_url(self, image_path: str) -> str:
+        mime_type, image_base64 = self.encode(image_path)
+        return f"data:{mime_type};base64,{image_base64}"
+
+    def _reencode(self, image_path: str, original: bytes) -> tuple:
+        original_mime = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        try:
+            with Image.open(BytesIO(original)) as image:
+                source_format = image.format
+                image = ImageOps.exif_transpose(image)
+                fits = max(image.size) <= self.max_edge
+                image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+                if self.image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                output = BytesIO()
+                image.save(output, format=self.image_format, quality=self.quality)
+        except Exception as e:
+            log(f"Warning: Could not re-encode {image_path}, sending original: {str(e)}", level="warning")
+            return original_mime, original
+
+        data = output.getvalue()
+        if fits and source_format == self.image_format and len(original) <= len(data):
+            return original_mime, original
+        return FORMAT_MIME_TYPES.get(self.image_format, original_mime), data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "encoded": self.encoded,
+                "cache_hits": self.cache_hits,
+                "cached_payloads": len(self._cache),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "encode_seconds": round(self.encode_seconds, 3),
+            }
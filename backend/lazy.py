@@ -0,0 +1,46 @@
+import threading
+from typing import Callable
+
+
+class Lazy:
+    """Stand-in for a shared resource that is only built on first use.
+
+    Attribute reads and writes go to the object ``factory`` returns, which is
+    built once, under a lock, the first time anything touches it. Modules can
+    import the stand-in by name, and importing them stays cheap no matter how
+    big the database or image tree behind the resource is.
+    """
+
+    def __init__(self, factory: Callable, name: str = ""):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_name", name or getattr(factory, "__name__", "resource"))
+        object.__setattr__(self, "_value", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def __getattr__(self, name: str):
+        return getattr(resolve(self), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(resolve(self), name, value)
+
+    def __iter__(self):
+        return iter(resolve(self))
+
+    def __repr__(self) -> str:
+        state = "loaded" if loaded(self) else "not loaded"
+        return f"<Lazy {self._name} ({state})>"
+
+
+def resolve(resource):
+    """Return the object behind ``resource``, building it if needed. Other objects are returned as is."""
+    if not isinstance(resource, Lazy):
+        return resource
+    if resource._value is None:
+        with resource._lock:
+            if resource._value is None:
+                object.__setattr__(resource, "_value", resource._factory())
+    return resource._value
+
+
+def loaded(resource) -> bool:
+    return not isinstance(resource, Lazy) or resource._value is not None
@@ -1,18 +1,50 @@
 import os
+import asyncio
 import json
-import base64
-import requests
-import shutil
-import zipfile
-from fastapi import FastAPI, HTTPException, File, UploadFile, BackgroundTasks  
-from fastapi.responses import FileResponse
+import time
+import uuid
+import itertools
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional
 from urllib.parse import unquote
 from fastapi.middleware.cors import CORSMiddleware
-
-app = FastAPI()
+import core
+from annotation_index import AnnotationQueryError
+from core import (
+    NEAR_DUPLICATE_CAPTIONS, STRUCTURED_LOGS, annotation_index, caption_batcher, captions_total, evaluate_with_pixtral,
+    encode_image, generated_json_file, generated_store, image_encoder, image_index, index_ready, lease_image,
+    manual_json_file, manual_store, metrics, model_backend, model_cache, near_duplicate_proposal, near_duplicates,
+    prefetcher, process_image_with_gemma, root_folder, saved_evaluation, stage_seconds, stream_gemma_caption,
+    thumbnail_folder, upload_ingestor,
+)
+from export import ExportError, export_entries, record_filter, stream_zip
+from metrics import log, trace_id_var
+from upload_ingest import UploadError, UploadIngestor
+
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WORKERS", "1"))  # Server processes sharing the data directory
+CLASSIC_UI_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+MAX_CANDIDATE_CAPTIONS = 8
+ANNOTATIONS_MAX_PAGE = 500
+
+http_request_seconds = metrics.histogram("car_damage_http_request_seconds", "HTTP request latency by route and status.")
+annotations_saved_total = metrics.counter("car_damage_annotations_saved_total", "Images saved from /review.")
+upload_bytes_total = metrics.counter("car_damage_upload_bytes_total", "Request body bytes received by /upload_folder.")
+uploaded_images_total = metrics.counter("car_damage_uploaded_images_total", "Uploaded files by outcome.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await core.start()
+    yield
+    await core.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,138 +52,79 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
-root_folder = "CarData"
-generated_json_file = "generated_car_damage_data.json"
-manual_json_file = "manual_car_damage_data.json"
-OPENROUTER_API_KEY = ""  # Add your OpenRouter API key here
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-SITE_URL = "<YOUR_SITE_URL>"
-SITE_NAME = "<YOUR_SITE_NAME>"
-MAX_RETRIES = 3
-
-app.mount("/images", StaticFiles(directory=root_folder), name="images")
-
-if not os.path.exists(root_folder):
-    raise FileNotFoundError(f"The folder {root_folder} does not exist.")
-
-def load_json(file_path: str):
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r") as file:
-                content = file.read().strip()
-                return json.loads(content) if content else []
-        except json.JSONDecodeError:
-            print(f"Warning: Invalid JSON in {file_path}. Starting with an empty list.")
-            return []
-    return []
-
-def save_json(data: list, file_path: str):
-    with open(file_path, "w") as json_file:
-        json.dump(data, json_file, indent=4)
-    print(f"JSON updated at {file_path}")
-
-def encode_image(image_path: str):
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode("utf-8")
-
-def process_image_with_gemma(image_path: str, relative_path: str) -> Optional[str]:
-    for attempt in range(MAX_RETRIES):
-        try:
-            image_base64 = encode_image(image_path)
-            prompt = (
-                "Describe a car’s condition in one paragraph for a car damage dataset, based on the provided image. "
-                "If visible damage exists, detail the type, the specific parts affected, the severity, and notable aspects like "
-                "the damage location. If no damage is visible, state that clearly and include the car’s "
-                "overall condition and any relevant observations. Ensure the description is clear, precise, and avoids assumptions "
-                "beyond the image content. Do not include introductory phrases like 'Here is a description,' 'Based on the image,' "
-                "'This image shows,' or any reference to the image itself and statements like 'further inspection is needed'; focus solely on the car’s state in a direct, standalone manner."
-            )
-
-            payload = {
-                "model": "google/gemma-3-12b-it:free",
-                "messages": [
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                    ]}
-                ]
-            }
-
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": SITE_URL,
-                "X-Title": SITE_NAME
-            }
-
-            response = requests.post(OPENROUTER_URL, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        except Exception as e:
-            print(f"Error for {relative_path} with Gemma (attempt {attempt + 1}): {str(e)}")
-            return None
-
-def evaluate_with_pixtral(image_path: str, caption: str) -> dict:
-    for attempt in range(MAX_RETRIES):
-        try:
-            image_base64 = encode_image(image_path)
-            evaluation_prompt = (
-                f"Evaluate the following description of a car’s condition based on the provided image. "
-                f"Score it out of 5 (1 being very inaccurate, 5 being very accurate) based on how well it describes the car’s visible condition. "
-                f"Provide a brief explanation for your score. Return your response in this format: 'Score: X/5 - Explanation: [your explanation]'. "
-                f"The description to evaluate is: '{caption}'"
-            )
-
-            payload = {
-                "model": "mistralai/pixtral-12b",
-                "messages": [
-                    {"role": "user", "content": [
-                        {"type": "text", "text": evaluation_prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                    ]}
-                ]
-            }
-
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": SITE_URL,
-                "X-Title": SITE_NAME
-            }
-
-            response = requests.post(OPENROUTER_URL, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
-            response_text = result["choices"][0]["message"]["content"]
-            
-            try:
-                score_line = response_text.split(' - ')[0]
-                score = int(score_line.split(':')[1].split('/')[0].strip())
-                explanation = response_text.split(' - Explanation: ')[1].strip()
-                return {"score": score, "explanation": explanation}
-            except Exception as e:
-                print(f"Error parsing Pixtral response: {e}")
-                return {"score": None, "explanation": response_text}
-        except Exception as e:
-            print(f"Error evaluating with Pixtral (attempt {attempt + 1}): {str(e)}")
-            return {"score": None, "explanation": "Evaluation failed"}
-
-def get_all_images():
-    image_extensions = (".jpg", ".jpeg", ".png")
-    generated_data = load_json(generated_json_file)
-    existing_paths = {entry["image"] for entry in generated_data}
-    image_files = []
-    for folder_name, _, files in os.walk(root_folder):
-        for file in files:
-            if file.lower().endswith(image_extensions):
-                image_path = os.path.join(folder_name, file)
-                relative_path = os.path.relpath(image_path, root_folder).replace("\\", "/")
-                if relative_path not in existing_paths:
-                    image_files.append((image_path, relative_path))
-    return image_files
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    trace_id = request.headers.get("X-Trace-Id") or uuid.uuid4().hex[:16]
+    token = trace_id_var.set(trace_id)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = trace_id
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        # Static mounts set no route, but their prefix ends up in root_path.
+        path = getattr(request.scope.get("route"), "path", None) or request.scope.get("root_path") or "unmatched"
+        http_request_seconds.observe(elapsed, method=request.method, route=path, status=str(status))
+        if STRUCTURED_LOGS:
+            log("request", method=request.method, route=path, status=status, duration_ms=round(elapsed * 1000, 2))
+        trace_id_var.reset(token)
+
+# Directories are checked (and the thumbnail folder created) at startup, not on import.
+app.mount("/images", StaticFiles(directory=root_folder, check_dir=False), name="images")
+app.mount("/thumbnails", StaticFiles(directory=thumbnail_folder, check_dir=False), name="thumbnails")
+app.mount("/static", StaticFiles(directory=os.path.join(CLASSIC_UI_FOLDER, "static"), check_dir=False), name="static")
+
+@app.get("/", include_in_schema=False)
+async def classic_index():
+    return FileResponse(os.path.join(CLASSIC_UI_FOLDER, "static", "index.html"))
+
+@app.get("/review/page", include_in_schema=False)
+async def classic_review():
+    """The plain HTML review page that the Flask app used to serve; it talks to the same JSON API."""
+    return FileResponse(os.path.join(CLASSIC_UI_FOLDER, "static", "review.html"))
+
+def reviewer_id(request: Request) -> str:
+    reviewer = request.headers.get("X-Reviewer-Id") or request.query_params.get("reviewer")
+    if not reviewer:
+        reviewer = request.client.host if request.client else "anonymous"
+    return reviewer[:128]
+
+def image_paths(relative_path: str) -> dict:
+    paths = {"image_path": relative_path}
+    if os.path.exists(upload_ingestor.thumbnail_path(relative_path)):
+        paths["thumbnail_path"] = f"{relative_path}.jpg"
+    return paths
+
+async def review_response(relative_path: str, gemma_caption: str) -> dict:
+    counts = await asyncio.to_thread(image_index.counts)
+    response = {
+        **image_paths(relative_path),
+        "gemma_caption": gemma_caption,
+        "total": counts["pending"] + counts["leased"],
+        "counts": counts
+    }
+    proposal = await asyncio.to_thread(near_duplicate_proposal, relative_path)
+    if proposal is not None:
+        response["near_duplicates"] = {"size": proposal["size"], "first_image": proposal["first_image"]}
+        if proposal["caption"] and proposal["caption"] != gemma_caption:
+            response["proposed_caption"] = proposal["caption"]
+    return response
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 class ReviewData(BaseModel):
     action: str
@@ -160,146 +133,391 @@ class ReviewData(BaseModel):
     manual_caption: Optional[str] = ''
     gemma_score: Optional[int] = None
     manual_score: Optional[int] = None
+    gemma_explanation: Optional[str] = None
+    manual_explanation: Optional[str] = None
+    candidate_captions: Optional[list[str]] = None
+    fetch_next: Optional[bool] = True
+
+def renew_active_lease(reviewer: str) -> Optional[tuple]:
+    """The ``(image_path, relative_path)`` ``reviewer`` already holds, with the lease renewed."""
+    leased = image_index.active_lease(reviewer)
+    if leased is not None and lease_image(leased[1], reviewer):
+        return leased
+    return None
+
+async def next_review(reviewer: str):
+    await index_ready()
+    leased = await asyncio.to_thread(renew_active_lease, reviewer)
+    if leased is not None:
+        return (*leased, await process_image_with_gemma(*leased))
+    return await prefetcher.next(reviewer)
 
 @app.get("/review")
-async def get_review():
-    image_files = get_all_images()
-    if not image_files:
+async def get_review(request: Request):
+    item = await next_review(reviewer_id(request))
+    if item is None:
         return {"message": "All images have been processed!", "done": True}
 
-    image_path, relative_path = image_files[0]
-    gemma_caption = process_image_with_gemma(image_path, relative_path)
+    _, relative_path, gemma_caption = item
     if gemma_caption:
-        return {
-            "image_path": relative_path,
-            "gemma_caption": gemma_caption,
-            "total": len(image_files)
-        }
+        return await review_response(relative_path, gemma_caption)
     raise HTTPException(status_code=500, detail="Failed to process image with Gemma")
 
+@app.get("/review/stream")
+async def stream_review(request: Request):
+    """Server-sent events for the next image: ``image`` as soon as it is leased,
+    ``token`` while Gemma writes the caption, ``caption`` with the full text,
+    then ``next`` if another image is already prefetched (for the UI to preload).
+    ``done`` means nothing is left; ``error`` means captioning failed.
+    """
+    reviewer = reviewer_id(request)
+
+    async def events():
+        await index_ready()
+        leased = await asyncio.to_thread(renew_active_lease, reviewer)
+        if leased is not None:
+            claimed = (leased[1], None)
+        else:
+            claimed = await prefetcher.claim(reviewer)
+        if claimed is None:
+            yield sse_event("done", {"message": "All images have been processed!", "done": True})
+            return
+
+        relative_path, pending = claimed
+        yield sse_event("image", await review_response(relative_path, ""))
+        gemma_caption = pending if isinstance(pending, str) else None
+        if isinstance(pending, asyncio.Task):
+            try:
+                gemma_caption = (await pending)[2]
+            except asyncio.CancelledError:
+                gemma_caption = None
+        if gemma_caption is None:
+            pieces = []
+            try:
+                async for piece in stream_gemma_caption(os.path.join(root_folder, relative_path), relative_path):
+                    pieces.append(piece)
+                    yield sse_event("token", {"text": piece})
+            except Exception as e:
+                log(f"Error for {relative_path} with Gemma: {str(e)}", level="error", image=relative_path)
+                captions_total.inc(outcome="failed")
+                await asyncio.to_thread(image_index.release, relative_path, reviewer)
+                yield sse_event("error", {"detail": "Failed to process image with Gemma"})
+                return
+            gemma_caption = "".join(pieces).strip()
+        yield sse_event("caption", {"image_path": relative_path, "gemma_caption": gemma_caption})
+
+        # Only an image that is ready now; waiting would hold the connection open after the caption.
+        next_path = await prefetcher.peek()
+        if next_path is not None:
+            yield sse_event("next", image_paths(next_path))
+
+    return event_stream(events())
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache_stats")
+async def cache_stats():
+    stats = {**model_cache.stats(), "image_encoding": image_encoder.stats()}
+    if NEAR_DUPLICATE_CAPTIONS:
+        stats["near_duplicates"] = await asyncio.to_thread(near_duplicates.stats)
+    return stats
+
+@app.get("/prefetch_stats")
+async def prefetch_stats():
+    return {**prefetcher.stats(), "batching": caption_batcher.stats()}
+
+@app.get("/api_stats")
+async def api_stats():
+    return model_backend.stats()
+
+@app.get("/review_stats")
+async def review_stats():
+    return await asyncio.to_thread(image_index.counts)
+
+def check_candidates(data: ReviewData) -> list:
+    candidates = data.candidate_captions or []
+    if len(candidates) > MAX_CANDIDATE_CAPTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CANDIDATE_CAPTIONS} candidate captions can be evaluated at once")
+    return candidates
+
+async def indexed_image(image_path: str) -> str:
+    """The index path of the image a client sent; anything that is not an indexed image under CarData is rejected."""
+    await index_ready()
+    for candidate in (image_path, unquote(image_path)):
+        relative_path = UploadIngestor.clean_relative_path(candidate)
+        if relative_path is not None and await asyncio.to_thread(image_index.is_indexed, relative_path):
+            return relative_path
+    raise HTTPException(status_code=400, detail="image_path is not an indexed image")
+
+async def encode_for_evaluation(full_image_path: str) -> Optional[str]:
+    try:
+        return await asyncio.to_thread(encode_image, full_image_path)
+    except OSError:
+        return None
+
 @app.post("/review")
-async def post_review(data: ReviewData):
-    image_files = get_all_images()
-    full_image_path = os.path.join(root_folder, unquote(data.image_path))
+async def post_review(data: ReviewData, request: Request):
+    relative_path = await indexed_image(data.image_path)
+    full_image_path = os.path.join(root_folder, relative_path)
+    reviewer = reviewer_id(request)
 
     if data.action == "check":
-        gemma_eval = evaluate_with_pixtral(full_image_path, data.gemma_caption) if data.gemma_caption else {"score": None, "explanation": "No Gemma caption provided"}
-        manual_eval = evaluate_with_pixtral(full_image_path, data.manual_caption) if data.manual_caption else {"score": None, "explanation": "No manual caption provided"}
-        return {
+        await asyncio.to_thread(lease_image, relative_path, reviewer)
+        candidates = check_candidates(data)
+
+        image_url = await encode_for_evaluation(full_image_path)
+
+        async def evaluate(caption: Optional[str], missing_message: str) -> dict:
+            if not caption:
+                return {"score": None, "explanation": missing_message}
+            return await evaluate_with_pixtral(full_image_path, caption, image_url)
+
+        gemma_eval, manual_eval, *candidate_evals = await asyncio.gather(
+            evaluate(data.gemma_caption, "No Gemma caption provided"),
+            evaluate(data.manual_caption, "No manual caption provided"),
+            *(evaluate(caption, "No caption provided") for caption in candidates)
+        )
+        response = {
             "gemma_score": gemma_eval["score"],
             "gemma_explanation": gemma_eval["explanation"],
             "manual_score": manual_eval["score"],
             "manual_explanation": manual_eval["explanation"]
         }
+        if candidates:
+            response["candidate_evaluations"] = [
+                {"caption": caption, "score": evaluation["score"], "explanation": evaluation["explanation"]}
+                for caption, evaluation in zip(candidates, candidate_evals)
+            ]
+        return response
 
     elif data.action == "save":
-        generated_data = load_json(generated_json_file)
-        manual_data = load_json(manual_json_file)
-
-        generated_entry = {"image": data.image_path, "caption": data.gemma_caption}
-        manual_entry = {"image": data.image_path, "caption": data.manual_caption}
-
-        generated_data.append(generated_entry)
-        if data.manual_caption:
-            manual_data.append(manual_entry)
+        # The claim is a single conditional UPDATE, so of concurrent saves of an image only one gets through.
+        if not await asyncio.to_thread(image_index.claim, relative_path, reviewer):
+            holder = await asyncio.to_thread(image_index.lease_holder, relative_path)
+            if holder is not None and holder != reviewer:
+                raise HTTPException(status_code=409, detail="This image is leased to another reviewer")
+            raise HTTPException(status_code=409, detail="This image has already been saved")
 
-        save_json(generated_data, generated_json_file)
-        save_json(manual_data, manual_json_file)
-
-        image_files = get_all_images()
-        if not image_files:
+        try:
+            gemma_eval, manual_eval = await asyncio.gather(
+                saved_evaluation(full_image_path, data.gemma_caption, data.gemma_score, data.gemma_explanation),
+                saved_evaluation(full_image_path, data.manual_caption, data.manual_score, data.manual_explanation),
+            )
+            created_at = time.time()
+            generated_entry = {"image": relative_path, "caption": data.gemma_caption, "created_at": created_at,
+                               "score": gemma_eval["score"], "explanation": gemma_eval["explanation"]}
+            manual_entry = {"image": relative_path, "caption": data.manual_caption, "created_at": created_at,
+                            "score": manual_eval["score"], "explanation": manual_eval["explanation"]}
+
+            writes = [generated_store.append(generated_entry)]
+            if data.manual_caption:
+                writes.append(manual_store.append(manual_entry))
+            with stage_seconds.time(stage="store_append"):
+                await asyncio.gather(*(asyncio.wrap_future(write) for write in writes))
+        except BaseException:
+            await asyncio.to_thread(image_index.mark_processed, relative_path, False)
+            raise
+        # The entry is in the store now, so the claim can be settled.
+        await asyncio.to_thread(image_index.mark_processed, relative_path)
+        with stage_seconds.time(stage="annotation_index"):
+            await asyncio.to_thread(annotation_index.sync)
+        if NEAR_DUPLICATE_CAPTIONS:
+            cluster = await asyncio.to_thread(near_duplicates.cluster_of, relative_path)
+            if cluster is not None:
+                await asyncio.to_thread(near_duplicates.set_caption, cluster, data.gemma_caption, source="reviewed")
+        annotations_saved_total.inc()
+        prefetcher.discard(relative_path)
+        if not data.fetch_next:
+            return {"message": "Saved"}
+
+        await index_ready()
+        item = await prefetcher.next(reviewer)
+        if item is None:
             return {"message": "All images processed!", "done": True}
 
-        next_image_path, next_relative_path = image_files[0]
-        gemma_caption = process_image_with_gemma(next_image_path, next_relative_path)
+        _, next_relative_path, gemma_caption = item
         if gemma_caption:
-            return {
-                "image_path": next_relative_path,
-                "gemma_caption": gemma_caption,
-                "total": len(image_files)
-            }
+            return await review_response(next_relative_path, gemma_caption)
         raise HTTPException(status_code=500, detail="Failed to process image with Gemma")
 
     raise HTTPException(status_code=400, detail="Invalid action")
 
-@app.post("/upload_folder")
-async def upload_folder(files: list[UploadFile] = File(...)):
-    try:
-        for file in files:
-            relative_path = file.filename
-            if not relative_path:
-                relative_path = file.filename
+@app.post("/review/check/stream")
+async def stream_check(data: ReviewData, request: Request):
+    """Server-sent ``score`` events, one per caption as soon as Pixtral has scored it, then ``done``.
+
+    Each event carries ``target`` (gemma, manual or candidate), ``index``
+    (the candidate's position, else null), ``score`` and ``explanation``.
+    """
+    relative_path = await indexed_image(data.image_path)
+    full_image_path = os.path.join(root_folder, relative_path)
+    await asyncio.to_thread(lease_image, relative_path, reviewer_id(request))
+    candidates = check_candidates(data)
+    image_url = await encode_for_evaluation(full_image_path)
+
+    async def evaluate(target: str, index: Optional[int], caption: Optional[str], missing_message: str) -> dict:
+        if not caption:
+            evaluation = {"score": None, "explanation": missing_message}
+        else:
+            evaluation = await evaluate_with_pixtral(full_image_path, caption, image_url)
+        return {"target": target, "index": index, **evaluation}
+
+    async def events():
+        tasks = [
+            asyncio.ensure_future(evaluate("gemma", None, data.gemma_caption, "No Gemma caption provided")),
+            asyncio.ensure_future(evaluate("manual", None, data.manual_caption, "No manual caption provided")),
+            *(asyncio.ensure_future(evaluate("candidate", index, caption, "No caption provided"))
+              for index, caption in enumerate(candidates)),
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield sse_event("score", await finished)
+            yield sse_event("done", {})
+        finally:
+            for task in tasks:
+                task.cancel()
 
-            if not file.content_type or not file.content_type.startswith("image/"):
-                print(f"Skipping non-image file: {relative_path}")
-                continue
+    return event_stream(events())
 
-            target_path = os.path.join(root_folder, relative_path)
-            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+@app.post("/upload_folder")
+async def upload_folder(request: Request):
+    def on_image(relative_path: str):
+        prefetcher.kick()
 
-            with open(target_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            print(f"Saved file: {target_path}")
+    async def counted_stream():
+        async for chunk in request.stream():
+            upload_bytes_total.inc(len(chunk))
+            yield chunk
 
-        return {"message": "Folder uploaded successfully"}
+    try:
+        with stage_seconds.time(stage="upload"):
+            summary = await upload_ingestor.ingest(request.headers.get("content-type", ""), counted_stream(), on_image)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Error in upload_folder: {str(e)}")
+        log(f"Error in upload_folder: {str(e)}", level="error")
         raise HTTPException(status_code=500, detail=f"Error uploading folder: {str(e)}")
-    finally:
-        for file in files:
-            file.file.close()
+    for outcome in ("saved", "duplicates", "skipped"):
+        uploaded_images_total.inc(summary[outcome], outcome=outcome)
+    uploaded_images_total.inc(len(summary["errors"]), outcome="errors")
+    return {"message": "Folder uploaded successfully", **summary}
+
+def parse_since(since: Optional[str], name: str = "since") -> Optional[float]:
+    if not since:
+        return None
+    try:
+        return float(since)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(since).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a Unix timestamp or an ISO 8601 date")
 
-def cleanup_zip_file(zip_filename: str):
-    if os.path.exists(zip_filename):
-        os.remove(zip_filename)
-        print(f"Cleaned up temporary file: {zip_filename}")
+def export_response(entries, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_zip(entries),
+        media_type='application/zip',
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 @app.get("/download_json")
-async def download_json(background_tasks: BackgroundTasks):
-    zip_filename = "car_damage_data.zip"
-    files_exist = False
+async def download_json():
+    stores = [
+        (os.path.splitext(os.path.basename(json_file))[0], store)
+        for store, json_file in ((generated_store, generated_json_file), (manual_store, manual_json_file))
+        if next(iter(store), None) is not None  # Opening a store creates its file, so look for an entry
+    ]
+    if not stores:
+        raise HTTPException(status_code=404, detail="No JSON files available to download")
+    return export_response(export_entries(stores, "json", record_filter()), "car_damage_data.zip")
+
+@app.get("/export")
+async def export_annotations(
+    format: str = "jsonl",
+    source: str = "all",
+    since: Optional[str] = None,
+    folder: Optional[str] = None,
+    include_images: bool = False,
+):
+    sources = {
+        "generated": [(os.path.splitext(os.path.basename(generated_json_file))[0], generated_store)],
+        "manual": [(os.path.splitext(os.path.basename(manual_json_file))[0], manual_store)],
+    }
+    sources["all"] = sources["generated"] + sources["manual"]
+    if source not in sources:
+        raise HTTPException(status_code=400, detail="source must be one of generated, manual, all")
+
+    keep = record_filter(since=parse_since(since), folder=folder)
+    entries = export_entries(sources[source], format, keep, root_folder=root_folder if include_images else None)
     try:
-        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            if os.path.exists(generated_json_file):
-                zipf.write(generated_json_file, os.path.basename(generated_json_file))
-                files_exist = True
-            else:
-                print(f"Warning: {generated_json_file} does not exist, skipping.")
-
-            if os.path.exists(manual_json_file):
-                zipf.write(manual_json_file, os.path.basename(manual_json_file))
-                files_exist = True
-            else:
-                print(f"Warning: {manual_json_file} does not exist, skipping.")
-
-        if not files_exist:
-            if os.path.exists(zip_filename):
-                os.remove(zip_filename)
-            raise HTTPException(status_code=404, detail="No JSON files available to download")
-
-        background_tasks.add_task(cleanup_zip_file, zip_filename)
-
-        return FileResponse(
-            zip_filename,
-            media_type='application/zip',
-            filename=zip_filename,
-            headers={"Content-Disposition": f"attachment; filename={zip_filename}"}
+        first = next(entries)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"car_damage_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return export_response(itertools.chain([first], entries), filename)
+
+@app.get("/annotations")
+async def list_annotations(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    min_score: Optional[int] = None,
+    max_score: Optional[int] = None,
+    score_of: str = "gemma",
+    has_manual: Optional[bool] = None,
+    folder: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """Saved annotations, newest first, one page at a time.
+
+    Pass the returned ``next_cursor`` back as ``cursor`` for the next page.
+    ``min_score``/``max_score`` filter on the gemma or manual score
+    (``score_of``), ``folder`` is a path prefix, ``since``/``until`` take a
+    Unix timestamp or ISO 8601 date, and ``q`` full-text searches both
+    captions.
+    """
+    if not 1 <= limit <= ANNOTATIONS_MAX_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {ANNOTATIONS_MAX_PAGE}")
+    since_timestamp, until_timestamp = parse_since(since), parse_since(until, "until")
+    await asyncio.to_thread(annotation_index.sync)
+    try:
+        return await asyncio.to_thread(
+            annotation_index.query,
+            limit=limit,
+            cursor=cursor,
+            min_score=min_score,
+            max_score=max_score,
+            score_of=score_of,
+            has_manual=has_manual,
+            folder=folder,
+            since=since_timestamp,
+            until=until_timestamp,
+            text=q,
         )
-    except Exception as e:
-        if os.path.exists(zip_filename):
-            os.remove(zip_filename)
-        print(f"Error creating ZIP file: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error creating ZIP file: {str(e)}")
+    except AnnotationQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/clear_json")
 async def clear_json_files():
     try:
-        with open(generated_json_file, 'w') as f:
-            json.dump([], f)
-
-        with open(manual_json_file, 'w') as f:
-            json.dump([], f)
+        generated_store.clear()
+        manual_store.clear()
 
+        image_index.sync_processed([])
+        annotation_index.rebuild()
+        prefetcher.kick()
         return {"message": "JSON files cleared successfully"}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error clearing JSON files: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error clearing JSON files: {str(e)}")
+
+def serve():
+    """Run the server. With ``WORKERS`` above 1 the processes share the data directory safely."""
+    import uvicorn
+    uvicorn.run("main:app", host=HOST, port=PORT, workers=WORKERS)
+
+if __name__ == "__main__":
+    serve()
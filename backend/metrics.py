@@ -0,0 +1,188 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+trace_id_var: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("trace_id", default=None)
+structured_logs = False
+
+
+def configure_logging(structured: bool):
+    global structured_logs
+    structured_logs = structured
+
+
+def log(message: str, level: str = "info", **fields):
+    """Print ``message``, or a JSON line with the current trace id when structured logs are on."""
+    if not structured_logs:
+        print(message)
+        return
+    record = {"ts": round(time.time(), 3), "level": level, "msg": message}
+    trace_id = trace_id_var.get()
+    if trace_id:
+        record["trace_id"] = trace_id
+    record.update(fields)
+    print(json.dumps(record, default=str), flush=True)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def lines(self) -> list:
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                labels = _format_labels((*key, ("le", _format_value(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Callback:
+    """A metric read at scrape time from ``collect()``.
+
+    ``collect`` returns a number, or a dict mapping values of ``label`` to
+    numbers.
+    """
+
+    def __init__(self, name: str, help_text: str, collect: Callable, kind: str = "gauge", label: Optional[str] = None):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.kind = kind
+        self.label = label
+
+    def lines(self) -> list:
+        values = self.collect()
+        if not isinstance(values, dict):
+            return [f"{self.name} {_format_value(values)}"]
+        return [
+            f"{self.name}{_format_labels(((self.label, key),))} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: list = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def callback(self, name: str, help_text: str, collect: Callable, kind: str = "gauge",
+                 label: Optional[str] = None) -> Callback:
+        return self._register(Callback(name, help_text, collect, kind, label))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.lines()
+            except Exception as e:
+                log(f"Error collecting metric {metric.name}: {str(e)}", level="error")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator that records how long each call takes in ``histogram``."""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
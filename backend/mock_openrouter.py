@@ -0,0 +1,155 @@
+"""Local stand-in for the OpenRouter chat completions API.
+
+Answers Gemma-style caption requests and Pixtral-style evaluation requests
+with deterministic text, after a configurable delay, and fails a
+configurable share of requests with 429/5xx. Requests with several images
+and ``[[IMAGE n]]`` markers get one marked caption per image. Token usage is
+estimated as one token per four characters of text plus ``IMAGE_TOKENS`` per
+image. Requests with ``"stream": true`` get the reply as server-sent
+events, one word per chunk, with half the delay before the first chunk and
+the rest spread over the others. Used for offline throughput testing:
+
+    python mock_openrouter.py --port 8099 --latency 0.5 --error-rate 0.05
+    OPENROUTER_URL=http://127.0.0.1:8099/api/v1/chat/completions python batch_caption.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stub_replies import prompt_parts, reply_for
+
+IMAGE_TOKENS = 256
+
+
+def prompt_tokens_for(payload: dict) -> int:
+    prompt, images = prompt_parts(payload)
+    return len(prompt) // 4 + IMAGE_TOKENS * len(images)
+
+
+class MockState:
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, payload: dict, content: str, duration: float):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            pieces = re.findall(r"\S+\s*", content) or [content]
+            for piece in pieces:
+                chunk = {"model": payload.get("model"), "choices": [{"index": 0, "delta": {"content": piece}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(duration / len(pieces))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with state.lock:
+                    body = {
+                        "requests": state.requests,
+                        "errors": state.errors,
+                        "prompt_tokens": state.prompt_tokens,
+                        "completion_tokens": state.completion_tokens,
+                    }
+                self._send_json(200, body)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            payload = json.loads(raw)
+            with state.lock:
+                state.requests += 1
+                delay = max(0.0, state.latency + state.random.uniform(-state.jitter, state.jitter))
+                fail = state.random.random() < state.error_rate
+                status = state.random.choice([429, 500, 502, 503]) if fail else 200
+                prompt_tokens = prompt_tokens_for(payload)
+                state.prompt_tokens += prompt_tokens
+                if fail:
+                    state.errors += 1
+            stream = bool(payload.get("stream"))
+            time.sleep(delay / 2 if stream and not fail else delay)
+            if fail:
+                self._send_json(status, {"error": {"code": status, "message": "Mock upstream error"}}, {"Retry-After": "1"})
+                return
+            content = reply_for(payload)
+            with state.lock:
+                state.completion_tokens += len(content) // 4
+            if stream:
+                self._send_stream(payload, content, delay / 2)
+                return
+            self._send_json(200, {
+                "id": f"mock-{state.requests}",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4},
+            })
+
+    return Handler
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.5,
+                      jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+    """Start the mock server in a background thread. Returns ``(server, url, state)``."""
+    state = MockState(latency, jitter, error_rate, seed)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/api/v1/chat/completions"
+    return server, url, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock OpenRouter chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter on latency, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/5xx.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url, _ = start_mock_server(args.host, args.port, args.latency, args.jitter, args.error_rate, args.seed)
+    print(f"Mock OpenRouter listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
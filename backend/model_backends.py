@@ -0,0 +1,238 @@
+import asyncio
+import base64
+import re
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+from metrics import log
+from stub_replies import reply_for
+
+try:
+    from transformers import pipeline as transformers_pipeline
+except ImportError:
+    transformers_pipeline = None
+
+BACKENDS = ("openrouter", "openai", "transformers", "stub")
+WARM_UP_MESSAGES = [{"role": "user", "content": [{"type": "text", "text": "Reply with OK."}]}]
+
+
+def completion(model: str, content: str) -> dict:
+    """Wrap ``content`` in the chat completions response shape the callers parse."""
+    return {
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+
+class QueuedBackend(ABC):
+    """Base for in-process backends that serve every model from one request queue.
+
+    ``chat_completion`` puts the payload on a shared queue. A single worker
+    takes up to ``max_batch`` requests that arrive within ``batch_window``
+    seconds and hands them to ``run_batch`` on a dedicated thread, so
+    CPU-bound inference never blocks the event loop and never runs more than
+    one batch at a time.
+    """
+
+    def __init__(self, max_batch: int = 4, batch_window: float = 0.05):
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.rate_limiter = None
+        self.counters = {"requests": 0, "successes": 0, "failures": 0, "batches": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self._busy = 0
+
+    @abstractmethod
+    def run_batch(self, payloads: list) -> list:
+        """Return one completion dict (or exception) per payload. Runs on the model thread."""
+
+    def load(self, models: list):
+        pass
+
+    async def warm_up(self, models: list):
+        started = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.load, models)
+        for model in models:
+            try:
+                await self.chat_completion({"model": model, "messages": WARM_UP_MESSAGES, "max_tokens": 1})
+            except Exception as e:
+                log(f"Warm-up request for {model} failed: {str(e)}", level="warning", model=model)
+        log(f"Warmed up {', '.join(models)} in {time.perf_counter() - started:.1f}s")
+
+    async def chat_completion(self, payload: dict) -> dict:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        future = asyncio.get_running_loop().create_future()
+        self.counters["requests"] += 1
+        await self._queue.put((payload, future))
+        return await future
+
+    async def stream_chat_completion(self, payload: dict):
+        """Yield the reply to ``payload``. Batched inference finishes a reply at once, so it comes in one piece."""
+        result = await self.chat_completion(payload)
+        yield result["choices"][0]["message"]["content"]
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+    def in_flight(self) -> dict:
+        return {"queued": self._queue.qsize() if self._queue is not None else 0, "running": self._busy}
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "average_batch": round(self.counters["requests"] / self.counters["batches"], 2)
+            if self.counters["batches"] else 0.0,
+            "in_flight": self.in_flight(),
+            "breakers": {},
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch = [(payload, future) for payload, future in batch if not future.done()]
+            if not batch:
+                continue
+            self.counters["batches"] += 1
+            self._busy = len(batch)
+            try:
+                results = await loop.run_in_executor(self._executor, self.run_batch, [p for p, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            finally:
+                self._busy = 0
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    self.counters["failures"] += 1
+                    future.set_exception(result)
+                else:
+                    self.counters["successes"] += 1
+                    future.set_result(result)
+
+
+class StubBackend(QueuedBackend):
+    """Deterministic backend for tests and offline runs.
+
+    Replies exactly like ``mock_openrouter`` (see ``stub_replies``: same
+    caption for the same image, parseable evaluation scores) after
+    ``latency`` seconds per batch.
+    Streamed replies come word by word.
+    """
+
+    def __init__(self, latency: float = 0.0, max_batch: int = 4, batch_window: float = 0.0):
+        super().__init__(max_batch=max_batch, batch_window=batch_window)
+        self.latency = latency
+
+    def run_batch(self, payloads: list) -> list:
+        if self.latency:
+            time.sleep(self.latency)
+        return [completion(payload["model"], reply_for(payload)) for payload in payloads]
+
+    async def stream_chat_completion(self, payload: dict):
+        result = await self.chat_completion(payload)
+        for piece in re.findall(r"\S+\s*", result["choices"][0]["message"]["content"]):
+            yield piece
+
+
+class TransformersBackend(QueuedBackend):
+    """Runs vision-language models in-process on CPU with Hugging Face ``transformers``.
+
+    ``model_ids`` maps the model names used in payloads to Hugging Face model
+    ids; models that share an id share one loaded pipeline. Requests for the
+    same model in a batch go through the pipeline in one call.
+    """
+
+    def __init__(self, model_ids: dict, max_batch: int = 4, batch_window: float = 0.05,
+                 max_new_tokens: int = 256, threads: int = 0):
+        if transformers_pipeline is None:
+            raise RuntimeError("The transformers backend requires the transformers and torch packages")
+        super().__init__(max_batch=max_batch, batch_window=batch_window)
+        self.model_ids = model_ids
+        self.max_new_tokens = max_new_tokens
+        self.threads = threads
+        self._pipelines: dict = {}
+
+    def load(self, models: list):
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        for model in models:
+            self._pipeline(model)
+
+    def _pipeline(self, model: str):
+        model_id = self.model_ids.get(model, model)
+        if model_id not in self._pipelines:
+            log(f"Loading {model_id} on CPU", model=model_id)
+            self._pipelines[model_id] = transformers_pipeline("image-text-to-text", model=model_id, device="cpu")
+        return self._pipelines[model_id]
+
+    @staticmethod
+    def _messages(payload: dict) -> list:
+        messages = []
+        for message in payload["messages"]:
+            content = message["content"]
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            parts = []
+            for part in content:
+                if part.get("type") == "image_url":
+                    url = part["image_url"]["url"]
+                    data = base64.b64decode(url.split(",", 1)[1]) if url.startswith("data:") else None
+                    parts.append({"type": "image", "image": Image.open(BytesIO(data)) if data else url})
+                else:
+                    parts.append(part)
+            messages.append({"role": message["role"], "content": parts})
+        return messages
+
+    def run_batch(self, payloads: list) -> list:
+        results: list = [None] * len(payloads)
+        by_model: dict = {}
+        for index, payload in enumerate(payloads):
+            by_model.setdefault(payload["model"], []).append(index)
+        for model, indexes in by_model.items():
+            try:
+                outputs = self._pipeline(model)(
+                    text=[self._messages(payloads[index]) for index in indexes],
+                    max_new_tokens=payloads[indexes[0]].get("max_tokens") or self.max_new_tokens,
+                    return_full_text=False,
+                    batch_size=len(indexes),
+                )
+                for index, output in zip(indexes, outputs):
+                    output = output[0] if isinstance(output, list) else output
+                    results[index] = completion(model, output["generated_text"].strip())
+            except Exception as e:
+                for index in indexes:
+                    results[index] = e
+        return results
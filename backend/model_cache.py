@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class FileHasher:
+    """Content hashes of image files, memoised on (path, mtime, size)."""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._hashes: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hash(self, path: str) -> str:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._hashes:
+                self._hashes.move_to_end(key)
+                return self._hashes[key]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._hashes[key] = content_hash
+            if len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+
+class ModelCache:
+    """Persistent LRU cache of model outputs, stored in SQLite.
+
+    Entries are grouped by ``kind`` (e.g. ``"caption"``, ``"evaluation"``)
+    for metrics. Values are JSON-encoded. Once more than ``max_entries`` are
+    stored, the least recently used ones are evicted.
+
+    Reads do not write: a hit only notes the entry's new ``last_used`` in
+    memory, and the noted times are written with the next ``put`` (before
+    anything is evicted) or on ``close``.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 200_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+            """
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self.hits: dict = {}
+        self.misses: dict = {}
+        self.evictions = 0
+        self._touched: dict = {}
+
+    def close(self):
+        with self._lock:
+            with self._conn:
+                self._write_touches()
+            self._conn.close()
+
+    def get(self, kind: str, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            self._touched[key] = time.time()
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+        return json.loads(row[0])
+
+    def put(self, kind: str, key: str, value):
+        with self._lock, self._conn:
+            self._write_touches()
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO entries (key, kind, value, last_used) VALUES (?, ?, ?, ?)",
+                (key, kind, json.dumps(value), time.time()),
+            )
+            if cursor.rowcount:
+                self._size += 1
+            else:
+                self._conn.execute(
+                    "UPDATE entries SET value = ?, last_used = ? WHERE key = ?",
+                    (json.dumps(value), time.time(), key),
+                )
+            if self._size > self.max_entries:
+                # Other processes sharing the database add and evict entries too.
+                self._size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if self._size > self.max_entries:
+                self._evict(self._size - self.max_entries + max(1, self.max_entries // 100))
+
+    def _write_touches(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self, count: int):
+        cursor = self._conn.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+            (count,),
+        )
+        self._size -= cursor.rowcount
+        self.evictions += cursor.rowcount
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self._touched.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        kinds = set(self.hits) | set(self.misses)
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "kinds": {
+                kind: {"hits": self.hits.get(kind, 0), "misses": self.misses.get(kind, 0)}
+                for kind in sorted(kinds)
+            },
+        }
+
+    @staticmethod
+    def caption_key(image_hash: str, model: str, prompt_version: int) -> str:
+        return f"caption:{image_hash}:{model}:{prompt_version}"
+
+    @staticmethod
+    def evaluation_key(image_hash: str, caption: str, model: str, prompt_version: int) -> str:
+        return f"evaluation:{image_hash}:{sha256_text(caption)}:{model}:{prompt_version}"
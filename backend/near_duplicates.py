@@ -0,0 +1,292 @@
+import bisect
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Optional
+
+from PIL import Image
+
+HASH_SIZE = 8
+BANDS = 4
+BAND_BITS = HASH_SIZE * HASH_SIZE // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+# Flat, blank or overexposed images hash to (almost) all zeros or all ones whatever they show.
+MIN_HASH_BITS = 4
+MAX_HASH_BITS = 60
+
+
+def dhash(image_path: str) -> int:
+    """64-bit difference hash of an image.
+
+    The image is shrunk to a 9x8 grayscale thumbnail and each bit records
+    whether a pixel is brighter than its right-hand neighbour, so re-encodes,
+    resizes and small exposure changes keep (almost) the same hash. JPEGs are
+    decoded at reduced size, so hashing costs a few milliseconds at most.
+    """
+    with Image.open(image_path) as image:
+        image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+        pixels = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:  # Python < 3.10
+    def popcount(value: int) -> int:
+        return bin(value).count("1")
+
+
+def hamming(a: int, b: int) -> int:
+    return popcount(a ^ b)
+
+
+def degenerate(value: int) -> bool:
+    """Whether a hash has too little structure to say anything about similarity."""
+    return not MIN_HASH_BITS < popcount(value) < MAX_HASH_BITS
+
+
+def _to_sqlite(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _from_sqlite(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """Perceptual-hash index that groups near-duplicate images into clusters.
+
+    Every hashed image joins the cluster of its closest indexed image within
+    ``max_distance`` bits (Hamming distance between dHashes), or starts a new
+    cluster. Each cluster can carry one caption to propose for all of its
+    images: the first model caption, replaced by the caption a reviewer saves.
+    Images with a ``degenerate`` hash are recorded but never clustered.
+
+    Lookups use multi-index hashing: the 64-bit hash is split into ``BANDS``
+    16-bit bands, and two hashes within ``max_distance`` bits must share a
+    band within ``max_distance // BANDS`` bits, so only those buckets are
+    probed. With a million images that is well under a millisecond per
+    lookup. Hashes and bands live in flat arrays in memory (about 40 bytes
+    per image); paths, clusters and captions are stored in SQLite. Hashes
+    other processes add are loaded before each lookup, so several server
+    processes can share one database.
+    """
+
+    def __init__(self, db_path: str, max_distance: int = 6):
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self._probe_masks = [
+            sum(1 << bit for bit in bits)
+            for radius in range(max_distance // BANDS + 1)
+            for bits in itertools.combinations(range(BAND_BITS), radius)
+        ]
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS hashes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                relative_path TEXT NOT NULL UNIQUE,
+                dhash INTEGER NOT NULL,
+                cluster INTEGER NOT NULL,
+                mtime REAL,
+                size INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS hashes_cluster ON hashes(cluster);
+            CREATE TABLE IF NOT EXISTS clusters (
+                id INTEGER PRIMARY KEY,
+                size INTEGER NOT NULL DEFAULT 0,
+                caption TEXT,
+                source TEXT,
+                updated_at REAL
+            );
+            """
+        )
+        self._ids = array("q")
+        self._values = array("Q")
+        self._clusters = array("q")
+        self._bands: list = [{} for _ in range(BANDS)]
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self._data_version = None
+        self._catch_up()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _catch_up(self):
+        """Load hashes committed by other connections since the last call."""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        last_id = self._ids[-1] if self._ids else 0
+        for row_id, value, cluster in self._conn.execute(
+            "SELECT id, dhash, cluster FROM hashes WHERE id > ? ORDER BY id", (last_id,)
+        ):
+            self._append(row_id, _from_sqlite(value), cluster)
+
+    def _append(self, row_id: int, value: int, cluster: int):
+        position = len(self._ids)
+        self._ids.append(row_id)
+        self._values.append(value)
+        self._clusters.append(cluster)
+        for band in range(BANDS):
+            key = (value >> (band * BAND_BITS)) & BAND_MASK
+            bucket = self._bands[band].get(key)
+            if bucket is None:
+                bucket = self._bands[band][key] = array("I")
+            bucket.append(position)
+
+    def _find(self, value: int) -> Optional[int]:
+        """Return the position of the closest live hash within ``max_distance``."""
+        started = time.perf_counter()
+        best, best_distance = None, self.max_distance + 1
+        values, clusters = self._values, self._clusters
+        for band in range(BANDS):
+            key = (value >> (band * BAND_BITS)) & BAND_MASK
+            buckets = self._bands[band]
+            for mask in self._probe_masks:
+                bucket = buckets.get(key ^ mask)
+                if bucket is None:
+                    continue
+                for position in bucket:
+                    distance = popcount(value ^ values[position])
+                    if distance < best_distance and clusters[position] >= 0:
+                        best, best_distance = position, distance
+        self.lookups += 1
+        self.lookup_seconds += time.perf_counter() - started
+        return best
+
+    def nearest(self, value: int) -> Optional[tuple]:
+        """Return ``(relative_path, distance)`` of the closest indexed image within ``max_distance``."""
+        with self._lock:
+            self._catch_up()
+            position = self._find(value)
+            if position is None:
+                return None
+            row = self._conn.execute("SELECT relative_path FROM hashes WHERE id = ?", (self._ids[position],)).fetchone()
+            return row[0], hamming(value, self._values[position])
+
+    def add(self, relative_path: str, value: int, mtime: Optional[float] = None,
+            size: Optional[int] = None) -> Optional[int]:
+        """Index ``relative_path`` with hash ``value`` and return its cluster id (None for a degenerate hash)."""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._catch_up()
+            previous = self._conn.execute(
+                "SELECT id, dhash, cluster FROM hashes WHERE relative_path = ?", (relative_path,)
+            ).fetchone()
+            if previous is not None:
+                if _from_sqlite(previous[1]) == value:
+                    self._conn.execute(
+                        "UPDATE hashes SET mtime = ?, size = ? WHERE id = ?", (mtime, size, previous[0])
+                    )
+                    return previous[2] if previous[2] >= 0 else None
+                self._remove(*previous)
+            if degenerate(value):
+                # Stored with a dead cluster, so the image is not hashed again and nothing matches it.
+                row_id = self._conn.execute(
+                    "INSERT INTO hashes (relative_path, dhash, cluster, mtime, size) VALUES (?, ?, -1, ?, ?)",
+                    (relative_path, _to_sqlite(value), mtime, size),
+                ).lastrowid
+                self._append(row_id, value, -1)
+                return None
+            position = self._find(value)
+            row_id = self._conn.execute(
+                "INSERT INTO hashes (relative_path, dhash, cluster, mtime, size) VALUES (?, ?, 0, ?, ?)",
+                (relative_path, _to_sqlite(value), mtime, size),
+            ).lastrowid
+            cluster = self._clusters[position] if position is not None else row_id
+            self._conn.execute("UPDATE hashes SET cluster = ? WHERE id = ?", (cluster, row_id))
+            self._conn.execute(
+                "INSERT INTO clusters (id, size) VALUES (?, 1) ON CONFLICT(id) DO UPDATE SET size = size + 1",
+                (cluster,),
+            )
+            self._append(row_id, value, cluster)
+            return cluster
+
+    def _remove(self, row_id: int, value: int, cluster: int):
+        # Positions are never reused; a negative cluster marks a dead slot.
+        position = bisect.bisect_left(self._ids, row_id)
+        if position < len(self._ids) and self._ids[position] == row_id:
+            self._clusters[position] = -1
+        self._conn.execute("DELETE FROM hashes WHERE id = ?", (row_id,))
+        self._conn.execute("UPDATE clusters SET size = size - 1 WHERE id = ?", (cluster,))
+
+    def add_file(self, image_path: str, relative_path: str) -> Optional[int]:
+        """Hash ``image_path`` unless it is indexed unchanged, and return its cluster id."""
+        stat = os.stat(image_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cluster FROM hashes WHERE relative_path = ? AND mtime = ? AND size = ?",
+                (relative_path, stat.st_mtime, stat.st_size),
+            ).fetchone()
+        if row is not None:
+            return row[0] if row[0] >= 0 else None
+        return self.add(relative_path, dhash(image_path), stat.st_mtime, stat.st_size)
+
+    def cluster_of(self, relative_path: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT cluster FROM hashes WHERE relative_path = ?", (relative_path,)).fetchone()
+        return row[0] if row and row[0] >= 0 else None
+
+    def cluster_info(self, relative_path: str) -> Optional[dict]:
+        """Return the first image and size of ``relative_path``'s cluster, if it has other images."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT clusters.size, first.relative_path FROM hashes "
+                "JOIN clusters ON clusters.id = hashes.cluster "
+                "LEFT JOIN hashes AS first ON first.id = hashes.cluster "
+                "WHERE hashes.relative_path = ?",
+                (relative_path,),
+            ).fetchone()
+        if row is None or row[0] < 2:
+            return None
+        return {"size": row[0], "first_image": row[1]}
+
+    def caption(self, cluster: int) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT caption FROM clusters WHERE id = ?", (cluster,)).fetchone()
+        return row[0] if row else None
+
+    def set_caption(self, cluster: int, caption: str, source: str = "model"):
+        """Record the caption to propose for ``cluster``. Model captions never replace reviewed ones."""
+        if not caption:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE clusters SET caption = ?, source = ?, updated_at = ? "
+                "WHERE id = ? AND (caption IS NULL OR ? = 'reviewed')",
+                (caption, source, time.time(), cluster, source),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            images, unclustered, clusters, captioned = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM hashes), "
+                "(SELECT COUNT(*) FROM hashes WHERE cluster < 0), "
+                "(SELECT COUNT(*) FROM clusters WHERE size > 0), "
+                "(SELECT COUNT(*) FROM clusters WHERE size > 1 AND caption IS NOT NULL)"
+            ).fetchone()
+        return {
+            "images": images,
+            "degenerate": unclustered,
+            "clusters": clusters,
+            "near_duplicates": images - unclustered - clusters,
+            "captioned_clusters": captioned,
+            "max_distance": self.max_distance,
+            "lookups": self.lookups,
+            "mean_lookup_us": round(1e6 * self.lookup_seconds / self.lookups, 2) if self.lookups else 0.0,
+        }
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+from typing import Optional
+
+import httpx
+
+from metrics import log
+from retry import RETRYABLE_STATUS_CODES, CircuitBreaker, RetryPolicy
+
+
+class OpenRouterClient:
+    """Shared async client for OpenRouter chat completions.
+
+    One ``httpx.AsyncClient`` is reused for every call so connections are
+    kept alive and pooled. Each model gets its own semaphore, which caps how
+    many requests for that model are in flight at once. An optional
+    ``rate_limiter`` (a ``rate_limit.TokenBucket``) is awaited before every
+    request to stay inside upstream quotas.
+
+    Transient failures (timeouts, connection errors, 429 and 5xx) are retried
+    according to ``retry_policy``, and each model has a ``CircuitBreaker``
+    that rejects calls outright while that model keeps failing.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        site_url: str,
+        site_name: str,
+        timeout: float = 60,
+        connect_timeout: float = 10,
+        max_connections: int = 32,
+        max_concurrency: int = 8,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker_threshold: int = 5,
+        breaker_reset_timeout: float = 30.0,
+    ):
+        self.url = url
+        self.headers = {
+            "Content-Type": "application/json",
+            "HTTP-Referer": site_url,
+            "X-Title": site_name,
+        }
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.counters = {"requests": 0, "successes": 0, "retries": 0, "giveups": 0, "rejected": 0}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores: dict = {}
+        self._breakers: dict = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(headers=self.headers, timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def warm_up(self, models: list):
+        """Send one tiny request per model so a local server has it loaded before the first review."""
+        for model in models:
+            started = time.perf_counter()
+            try:
+                await self.chat_completion({
+                    "model": model,
+                    "messages": [{"role": "user", "content": [{"type": "text", "text": "Reply with OK."}]}],
+                    "max_tokens": 1,
+                })
+                log(f"Warmed up {model} in {time.perf_counter() - started:.1f}s", model=model)
+            except Exception as e:
+                log(f"Warm-up request for {model} failed: {str(e)}", level="warning", model=model)
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[model]
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(model, self.breaker_threshold, self.breaker_reset_timeout)
+        return self._breakers[model]
+
+    def in_flight(self) -> dict:
+        return {model: self.max_concurrency - sem._value for model, sem in self._semaphores.items()}
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "in_flight": self.in_flight(),
+            "breakers": {model: breaker.stats() for model, breaker in self._breakers.items()},
+        }
+
+    @staticmethod
+    def _classify(error: Exception) -> tuple:
+        """Return ``(retryable, retry_after_seconds)`` for a failed request."""
+        if isinstance(error, httpx.HTTPStatusError):
+            retryable = error.response.status_code in RETRYABLE_STATUS_CODES
+            return retryable, RetryPolicy.parse_retry_after(error.response.headers.get("Retry-After"))
+        return isinstance(error, httpx.TransportError), None
+
+    async def _post(self, payload: dict) -> dict:
+        async with self._semaphore(payload["model"]):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            self.counters["requests"] += 1
+            response = await self.client.post(self.url, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def chat_completion(self, payload: dict) -> dict:
+        breaker = self._breaker(payload["model"])
+        attempt = 0
+        while True:
+            try:
+                breaker.before_call()
+            except Exception:
+                self.counters["rejected"] += 1
+                raise
+            try:
+                result = await self._post(payload)
+            except Exception as e:
+                retryable, retry_after = self._classify(e)
+                if not retryable:
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                delay = self.retry_policy.delay(attempt, retry_after)
+                if delay is None:
+                    self.counters["giveups"] += 1
+                    log(f"Giving up on {payload['model']} after {attempt + 1} attempts: {str(e)}", level="error",
+                        model=payload["model"], attempts=attempt + 1)
+                    raise
+                self.counters["retries"] += 1
+                attempt += 1
+                log(f"Retrying {payload['model']} in {delay:.1f}s (attempt {attempt}): {str(e)}", level="warning",
+                    model=payload["model"], attempt=attempt, delay=round(delay, 3))
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            self.counters["successes"] += 1
+            return result
+
+    async def stream_chat_completion(self, payload: dict):
+        """Yield the reply to ``payload`` piece by piece as the server streams it.
+
+        Retries and the circuit breaker apply until the first piece arrives;
+        a failure after that is raised to the caller as is.
+        """
+        breaker = self._breaker(payload["model"])
+        attempt = 0
+        while True:
+            try:
+                breaker.before_call()
+            except Exception:
+                self.counters["rejected"] += 1
+                raise
+            streamed = False
+            try:
+                async with self._semaphore(payload["model"]):
+                    if self.rate_limiter is not None:
+                        await self.rate_limiter.acquire()
+                    self.counters["requests"] += 1
+                    async with self.client.stream("POST", self.url, json={**payload, "stream": True}) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            choice = json.loads(data)["choices"][0]
+                            text = (choice.get("delta") or choice.get("message") or {}).get("content")
+                            if text:
+                                streamed = True
+                                yield text
+            except Exception as e:
+                retryable, retry_after = self._classify(e)
+                if streamed or not retryable:
+                    if streamed:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    raise
+                breaker.record_failure()
+                delay = self.retry_policy.delay(attempt, retry_after)
+                if delay is None:
+                    self.counters["giveups"] += 1
+                    log(f"Giving up on {payload['model']} stream after {attempt + 1} attempts: {str(e)}", level="error",
+                        model=payload["model"], attempts=attempt + 1)
+                    raise
+                self.counters["retries"] += 1
+                attempt += 1
+                log(f"Retrying {payload['model']} stream in {delay:.1f}s (attempt {attempt}): {str(e)}", level="warning",
+                    model=payload["model"], attempt=attempt, delay=round(delay, 3))
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            self.counters["successes"] += 1
+            return
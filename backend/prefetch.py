@@ -0,0 +1,220 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from metrics import log
+
+
+class CaptionPrefetcher:
+    """Keeps a bounded look-ahead of pre-captioned images for /review.
+
+    ``list_images(limit)`` returns up to ``limit`` unprocessed, unleased
+    ``(image_path, relative_path)`` pairs. Slots are kept in that order so
+    reviewers see images in the same order as before; captioning runs in the
+    background.
+    An image is only handed to a reviewer once ``await
+    lease_image(relative_path, reviewer)`` succeeds, so concurrent reviewers
+    always get different images. Images whose caption failed are skipped for
+    ``failure_hold_seconds`` so the refill does not retry them immediately.
+    """
+
+    def __init__(
+        self,
+        list_images: Callable[[int], list],
+        caption_image: Callable[[str, str], Awaitable[Optional[str]]],
+        lease_image: Callable[[str, str], Awaitable[bool]],
+        release_image: Callable[[str, str], Awaitable[None]],
+        depth: int = 4,
+        max_in_flight: int = 2,
+        failure_hold_seconds: float = 30,
+    ):
+        self.list_images = list_images
+        self.caption_image = caption_image
+        self.lease_image = lease_image
+        self.release_image = release_image
+        self.depth = depth
+        self.max_in_flight = max_in_flight
+        self.failure_hold_seconds = failure_hold_seconds
+        self.slots: "OrderedDict[str, asyncio.Task]" = OrderedDict()
+        self.held: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            self.kick()
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in self.slots.values():
+            task.cancel()
+        self.slots.clear()
+
+    def kick(self):
+        self._wakeup.set()
+
+    def discard(self, relative_path: str):
+        task = self.slots.pop(relative_path, None)
+        if task is not None:
+            task.cancel()
+        self.kick()
+
+    def stats(self) -> dict:
+        ready = sum(1 for task in self.slots.values() if task.done())
+        return {
+            "depth": self.depth,
+            "queue_depth": ready,
+            "in_flight": len(self.slots) - ready,
+            "failed_held": len(self.held),
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+        }
+
+    async def next(self, reviewer: str):
+        """Lease the next image to ``reviewer`` and return ``(image_path, relative_path, caption)``.
+
+        Returns ``None`` once there is nothing left to caption. ``caption`` is
+        ``None`` when the model call failed for the chosen image.
+        """
+        for relative_path, task in list(self.slots.items()):
+            if self.slots.get(relative_path) is not task or not task.done() or task.cancelled():
+                continue
+            del self.slots[relative_path]
+            result = task.result()
+            if result[2] is None or not await self.lease_image(relative_path, reviewer):
+                continue
+            self.hits += 1
+            self.kick()
+            return result
+
+        self.misses += 1
+        while self.slots:
+            relative_path, task = self.slots.popitem(last=False)
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                continue
+            if result[2] is not None and await self.lease_image(relative_path, reviewer):
+                self.kick()
+                return result
+
+        self._expire_holds()
+        image_files = await asyncio.to_thread(self.list_images, len(self.held) + self.depth)
+        candidates = [item for item in image_files if item[1] not in self.held] or image_files
+        for image_path, relative_path in candidates:
+            if not await self.lease_image(relative_path, reviewer):
+                continue
+            task = self.slots.pop(relative_path, None)
+            if task is not None:
+                try:
+                    caption = (await task)[2]
+                except asyncio.CancelledError:
+                    caption = await self.caption_image(image_path, relative_path)
+            else:
+                caption = await self.caption_image(image_path, relative_path)
+            if caption is None:
+                self.failures += 1
+                self._hold(relative_path)
+                await self.release_image(relative_path, reviewer)
+            self.kick()
+            return image_path, relative_path, caption
+        return None
+
+    async def claim(self, reviewer: str):
+        """Lease the next image to ``reviewer`` without waiting for its caption.
+
+        Returns ``(relative_path, pending)``, or ``None`` once there is nothing
+        left to caption. ``pending`` is the prefetched caption, the task still
+        producing ``(image_path, relative_path, caption)``, or ``None`` when
+        captioning has not started for that image.
+        """
+        for relative_path, task in list(self.slots.items()):
+            if not task.done() or task.cancelled() or task.result()[2] is None:
+                continue
+            if self.slots.get(relative_path) is task and await self.lease_image(relative_path, reviewer):
+                self.slots.pop(relative_path, None)
+                self.hits += 1
+                self.kick()
+                return relative_path, task.result()[2]
+
+        self.misses += 1
+        for relative_path, task in list(self.slots.items()):
+            if task.done() or self.slots.get(relative_path) is not task \
+                    or not await self.lease_image(relative_path, reviewer):
+                continue
+            self.slots.pop(relative_path, None)
+            self.kick()
+            return relative_path, task
+
+        self._expire_holds()
+        image_files = await asyncio.to_thread(self.list_images, len(self.held) + self.depth)
+        candidates = [item for item in image_files if item[1] not in self.held] or image_files
+        for _, relative_path in candidates:
+            if await self.lease_image(relative_path, reviewer):
+                self.kick()
+                return relative_path, self.slots.pop(relative_path, None)
+        return None
+
+    async def peek(self, timeout: float = 0) -> Optional[str]:
+        """Return the next image with a caption ready, waiting up to ``timeout`` seconds for one."""
+        for attempt in range(2):
+            for relative_path, task in self.slots.items():
+                if task.done() and not task.cancelled() and task.result()[2] is not None:
+                    return relative_path
+            running = [task for task in self.slots.values() if not task.done()]
+            if attempt or not running or timeout <= 0:
+                return None
+            await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        return None
+
+    def _hold(self, relative_path: str):
+        self.held[relative_path] = time.monotonic() + self.failure_hold_seconds
+
+    def _expire_holds(self):
+        now = time.monotonic()
+        for relative_path in [path for path, until in self.held.items() if until <= now]:
+            del self.held[relative_path]
+
+    async def _caption(self, image_path: str, relative_path: str):
+        async with self._semaphore:
+            caption = await self.caption_image(image_path, relative_path)
+        if caption is None:
+            self.failures += 1
+            self._hold(relative_path)
+        return image_path, relative_path, caption
+
+    async def _fill(self):
+        if len(self.slots) >= self.depth:
+            return
+        self._expire_holds()
+        image_files = await asyncio.to_thread(
+            self.list_images, self.depth + len(self.slots) + len(self.held)
+        )
+        for image_path, relative_path in image_files:
+            if len(self.slots) >= self.depth:
+                break
+            if relative_path in self.slots or relative_path in self.held:
+                continue
+            self.slots[relative_path] = asyncio.create_task(self._caption(image_path, relative_path))
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self._fill()
+            except Exception as e:
+                log(f"Error refilling caption prefetch queue: {str(e)}", level="error")
@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter, honouring ``Retry-After`` when given.
+
+    The delay before retry ``attempt`` (0-based) is drawn uniformly from
+    ``[(1 - jitter) * d, d]`` with ``d = min(max_delay, base_delay * 2 ** attempt)``.
+    A ``Retry-After`` value overrides that delay; if it is longer than
+    ``max_retry_after`` the call gives up instead of waiting.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 jitter: float = 0.5, max_retry_after: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """Seconds to wait before the next attempt, or ``None`` to give up."""
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(ceiling * (1 - self.jitter), ceiling)
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker around one upstream.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    ``before_call`` raises ``CircuitOpenError`` for ``reset_timeout`` seconds.
+    It then lets a single trial call through (half-open); success closes the
+    breaker, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Circuit for {self.name} is open")
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                # A trial that never reported back (e.g. it was cancelled) stops blocking after reset_timeout.
+                if self._trial_in_flight and time.monotonic() - self._trial_started < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Circuit for {self.name} is half-open")
+                self._trial_in_flight = True
+                self._trial_started = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,38 @@
+"""Deterministic model replies shared by ``mock_openrouter`` and the stub backend.
+
+A caption depends only on the image, and an evaluation only on the prompt,
+so the same request always gets the same reply. Evaluations use the
+``Score: X/5 - Explanation: ...`` format the pipeline parses.
+"""
+import hashlib
+
+DAMAGE_TYPES = ["a shallow dent", "deep scratches", "a cracked bumper", "a shattered headlight", "scuffed paint"]
+CAR_PARTS = ["front bumper", "rear door", "driver-side fender", "hood", "tailgate"]
+
+
+def caption_for(image_url: str) -> str:
+    digest = hashlib.sha256(image_url.encode("utf-8")).digest()
+    damage = DAMAGE_TYPES[digest[0] % len(DAMAGE_TYPES)]
+    part = CAR_PARTS[digest[1] % len(CAR_PARTS)]
+    return f"The car has {damage} on the {part}; the rest of the body appears intact."
+
+
+def evaluation_for(text: str) -> str:
+    score = 1 + hashlib.sha256(text.encode("utf-8")).digest()[0] % 5
+    return f"Score: {score}/5 - Explanation: Mock evaluation of the provided description."
+
+
+def prompt_parts(payload: dict) -> tuple:
+    content = payload["messages"][0]["content"]
+    texts = [part["text"] for part in content if part.get("type") == "text"]
+    images = [part["image_url"]["url"] for part in content if part.get("type") == "image_url"]
+    return " ".join(texts), images
+
+
+def reply_for(payload: dict) -> str:
+    prompt, images = prompt_parts(payload)
+    if prompt.startswith("Evaluate the following description"):
+        return evaluation_for(prompt)
+    if len(images) > 1 and "[[IMAGE 1]]" in prompt:
+        return "\n\n".join(f"[[IMAGE {number}]]\n{caption_for(image)}" for number, image in enumerate(images, 1))
+    return caption_for(images[0] if images else prompt)
@@ -0,0 +1,94 @@
+"""Run the server in-process on the stub model backend, against a throwaway data directory.
+
+``core`` reads its configuration when it is imported, so the environment is
+set up here, before any test module imports it. Install the test
+dependencies with ``pip install -r requirements-dev.txt``.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_FOLDER)
+DATA_DIR = tempfile.mkdtemp(prefix="car-damage-tests-")
+os.makedirs(os.path.join(DATA_DIR, "CarData"))
+os.environ.update(CAR_DAMAGE_DATA_DIR=DATA_DIR, MODEL_BACKEND="stub", NEAR_DUPLICATE_CAPTIONS="1")
+os.environ.pop("CAR_DAMAGE_ROOT", None)
+
+import httpx
+from PIL import Image
+
+import core
+import main
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def server(loop):
+    lifespan = main.app.router.lifespan_context(main.app)
+    loop.run_until_complete(lifespan.__aenter__())
+    loop.run_until_complete(core.startup_task)
+    yield main.app
+    loop.run_until_complete(lifespan.__aexit__(None, None, None))
+
+
+@pytest.fixture
+def request_all(loop, server):
+    """Send requests to the app concurrently: ``request_all(("GET", "/review", {...}), ...)`` returns the responses."""
+    def request_all(*requests):
+        async def send():
+            transport = httpx.ASGITransport(app=server)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await asyncio.gather(*(
+                    client.request(method, url, **options) for method, url, options in requests
+                ))
+        return loop.run_until_complete(send())
+    return request_all
+
+
+@pytest.fixture
+def call(request_all):
+    def call(method: str, url: str, **options) -> httpx.Response:
+        return request_all((method, url, options))[0]
+    return call
+
+
+def textured_image(seed: str) -> Image.Image:
+    rng = random.Random(seed)
+    blocks = Image.new("RGB", (16, 12))
+    blocks.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(16 * 12)])
+    return blocks.resize((160, 120), Image.NEAREST)
+
+
+@pytest.fixture
+def add_images(server):
+    """Write images into their own folder of CarData and index them; returns their relative paths.
+
+    Each image is textured differently, so none are near-duplicates of each
+    other and every one is captioned by the model.
+    """
+    def add_images(folder: str, count: int) -> list:
+        relative_paths = []
+        for number in range(count):
+            relative_path = f"{folder}/img{number}.jpg"
+            absolute = os.path.join(core.root_folder, relative_path)
+            os.makedirs(os.path.dirname(absolute), exist_ok=True)
+            textured_image(relative_path).save(absolute, format="JPEG", quality=95)
+            core.image_index.add_file(relative_path)
+            relative_paths.append(relative_path)
+        return relative_paths
+    return add_images
+
+
+def saved_entries(store, image: str) -> list:
+    return [entry for entry in store if entry.get("image") == image]
@@ -0,0 +1,64 @@
+import core
+
+FOLDER = "annotations_query"
+
+
+def setup_module():
+    for number in range(5):
+        image = f"{FOLDER}/img{number}.jpg"
+        core.generated_store.append({
+            "image": image, "caption": f"Scratch number {number} on the door", "created_at": 1000 + number,
+            "score": number + 1, "explanation": "test",
+        }).result()
+        if number % 2 == 0:
+            core.manual_store.append({
+                "image": image, "caption": f"Reviewed dent {number}", "created_at": 1000 + number, "score": 5,
+            }).result()
+
+
+def images(page: dict) -> list:
+    return [item["image"].rpartition("/")[2] for item in page["items"]]
+
+
+def test_pages_newest_first(call):
+    seen, cursor = [], None
+    while True:
+        params = {"folder": FOLDER, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = call("GET", "/annotations", params=params).json()
+        seen.extend(images(page))
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == [f"img{number}.jpg" for number in range(4, -1, -1)]
+
+
+def test_filters(call):
+    def query(**params):
+        response = call("GET", "/annotations", params={"folder": FOLDER, **params})
+        assert response.status_code == 200, response.text
+        return images(response.json())
+
+    assert query(min_score=4) == ["img4.jpg", "img3.jpg"]
+    assert query(max_score=2, score_of="gemma") == ["img1.jpg", "img0.jpg"]
+    assert query(has_manual="true") == ["img4.jpg", "img2.jpg", "img0.jpg"]
+    assert query(has_manual="false", min_score=5, score_of="manual") == []
+    assert query(since="1001", until="1003") == ["img2.jpg", "img1.jpg"]
+    assert query(q="reviewed dent") == ["img4.jpg", "img2.jpg", "img0.jpg"]
+    assert query(q="scratch", min_score=3, limit=1) == ["img4.jpg"]
+    assert call("GET", "/annotations", params={"folder": FOLDER[:-1]}).json()["items"] == []
+
+
+def test_manual_fields_are_joined(call):
+    item = call("GET", "/annotations", params={"folder": FOLDER, "limit": 1}).json()["items"][0]
+
+    assert item["gemma_caption"] == "Scratch number 4 on the door"
+    assert item["manual_caption"] == "Reviewed dent 4"
+    assert item["manual_score"] == 5
+
+
+def test_invalid_parameters(call):
+    assert call("GET", "/annotations", params={"limit": 0}).status_code == 400
+    assert call("GET", "/annotations", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert call("GET", "/annotations", params={"score_of": "pixtral"}).status_code == 400
+    assert call("GET", "/annotations", params={"since": "yesterday"}).status_code == 400
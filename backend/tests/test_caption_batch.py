@@ -0,0 +1,30 @@
+from caption_batch import build_batch_payload, parse_batch_reply
+from stub_replies import reply_for
+
+
+def test_parse_batch_reply_in_any_order():
+    reply = "Here you go.\n[[IMAGE 2]]\nSecond car.\n\n[[IMAGE 1]]\nFirst car.\n"
+
+    assert parse_batch_reply(reply, 2) == ["First car.", "Second car."]
+
+
+def test_parse_batch_reply_missing_or_empty_caption():
+    assert parse_batch_reply("[[IMAGE 1]]\nFirst car.", 2) is None
+    assert parse_batch_reply("[[IMAGE 1]]\nFirst car.\n[[IMAGE 2]]\n  ", 2) is None
+    assert parse_batch_reply("No markers at all.", 1) is None
+
+
+def test_parse_batch_reply_ignores_repeated_and_unknown_markers():
+    reply = "[[IMAGE 1]] First car. [[IMAGE 1]] Again. [[IMAGE 3]] Extra. [[IMAGE 2]] Second car."
+
+    assert parse_batch_reply(reply, 2) == ["First car.", "Second car."]
+
+
+def test_stub_reply_to_batch_payload_splits_per_image():
+    image_urls = [f"data:image/jpeg;base64,{number}" for number in range(3)]
+    payload = build_batch_payload("stub/gemma", "Describe the car.", image_urls)
+
+    captions = parse_batch_reply(reply_for(payload), len(image_urls))
+
+    single = [reply_for(build_batch_payload("stub/gemma", "Describe the car.", [url])) for url in image_urls]
+    assert captions == single
@@ -0,0 +1,90 @@
+import io
+import json
+import os
+import zipfile
+
+import core
+import main
+from annotation_store import AnnotationStore
+from conftest import DATA_DIR
+from export import record_filter
+
+
+def append(store, *entries):
+    for entry in entries:
+        store.append(entry).result()
+
+
+def export_archive(call, **params) -> zipfile.ZipFile:
+    response = call("GET", "/export", params=params)
+    assert response.status_code == 200, response.text
+    return zipfile.ZipFile(io.BytesIO(response.content))
+
+
+def test_record_filter():
+    keep = record_filter(since=100, folder="/a/", images={"a/x.jpg", "a/y.jpg", "ab/z.jpg"})
+
+    assert keep({"image": "a/x.jpg", "created_at": 100})
+    assert not keep({"image": "a/y.jpg", "created_at": 99})
+    assert not keep({"image": "ab/z.jpg", "created_at": 200})
+    assert not keep({"image": "a/w.jpg", "created_at": 200})
+
+
+def test_export_filters_by_source_folder_and_date(call):
+    append(core.generated_store,
+           {"image": "export_filters/old.jpg", "caption": "old", "created_at": 1000},
+           {"image": "export_filters/new.jpg", "caption": "new", "created_at": 2000},
+           {"image": "export_filters_sibling/new.jpg", "caption": "sibling", "created_at": 2000})
+    append(core.manual_store, {"image": "export_filters/new.jpg", "caption": "manual", "created_at": 2000})
+
+    archive = export_archive(call, source="generated", folder="export_filters", since="1500")
+
+    assert archive.namelist() == ["generated_car_damage_data.jsonl"]
+    records = [json.loads(line) for line in archive.read("generated_car_damage_data.jsonl").splitlines()]
+    assert [record["caption"] for record in records] == ["new"]
+
+
+def test_export_csv_of_both_stores(call):
+    append(core.manual_store, {"image": "export_csv/a.jpg", "caption": "manual, with comma", "created_at": 1})
+
+    archive = export_archive(call, format="csv", folder="export_csv")
+
+    assert sorted(archive.namelist()) == ["generated_car_damage_data.csv", "manual_car_damage_data.csv"]
+    assert b'"manual, with comma"' in archive.read("manual_car_damage_data.csv")
+
+
+def test_export_rejects_unknown_format_and_source(call):
+    assert call("GET", "/export", params={"format": "xml"}).status_code == 400
+    assert call("GET", "/export", params={"source": "everything"}).status_code == 400
+
+
+def test_export_images_stay_inside_car_data(add_images, call):
+    image, = add_images("export_images", 1)
+    with open(os.path.join(DATA_DIR, "secret.txt"), "w") as file:
+        file.write("secret")
+    append(core.generated_store,
+           {"image": image, "caption": "kept", "created_at": 1},
+           {"image": "../secret.txt", "caption": "outside", "created_at": 1},
+           {"image": "export_images/../../secret.txt", "caption": "outside", "created_at": 1},
+           {"image": os.path.join(DATA_DIR, "secret.txt"), "caption": "absolute", "created_at": 1})
+
+    archive = export_archive(call, source="generated", include_images="true")
+
+    images = [name for name in archive.namelist() if name.startswith("images/")]
+    assert f"images/{image}" in images
+    assert all(".." not in name.split("/") and "secret" not in name for name in images)
+    assert all(archive.read(name) != b"secret" for name in images)
+
+
+def test_download_json_needs_saved_entries(call, monkeypatch, tmp_path):
+    generated, manual = AnnotationStore(str(tmp_path / "generated.jsonl")), AnnotationStore(str(tmp_path / "manual.jsonl"))
+    monkeypatch.setattr(main, "generated_store", generated)
+    monkeypatch.setattr(main, "manual_store", manual)
+
+    assert call("GET", "/download_json").status_code == 404
+    generated.append({"image": "download/a.jpg", "caption": "saved", "created_at": 1}).result()
+    archive = zipfile.ZipFile(io.BytesIO(call("GET", "/download_json").content))
+
+    assert archive.namelist() == ["generated_car_damage_data.json"]
+    generated.close()
+    manual.close()
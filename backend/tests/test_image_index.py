@@ -0,0 +1,33 @@
+import os
+import threading
+
+from image_index import ImageIndex
+
+
+def test_rescan_does_not_block_other_calls(tmp_path):
+    root = tmp_path / "CarData"
+    for folder in ("a", "b"):
+        os.makedirs(root / folder)
+        (root / folder / "img.jpg").write_bytes(b"")
+    index = ImageIndex(str(root), str(tmp_path / "index.db"))
+    scanning, resume = threading.Event(), threading.Event()
+    scan_folder = index._scan_folder
+
+    def slow_scan_folder(*args):
+        scanning.set()
+        assert resume.wait(5)
+        return scan_folder(*args)
+
+    index._scan_folder = slow_scan_folder
+    scan = threading.Thread(target=index.refresh, kwargs={"force": True})
+    scan.start()
+    try:
+        assert scanning.wait(5)
+        assert index.counts() == {"pending": 0, "leased": 0, "done": 0}
+        assert index.refresh() == 0
+    finally:
+        resume.set()
+        scan.join()
+
+    assert index.counts()["pending"] == 2
+    index.close()
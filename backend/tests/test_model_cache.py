@@ -0,0 +1,19 @@
+from model_cache import ModelCache
+
+
+def test_hits_do_not_write_but_still_count_for_eviction(tmp_path):
+    cache = ModelCache(str(tmp_path / "cache.db"), max_entries=3)
+    for key in ("first", "second", "third"):
+        cache.put("caption", key, f"the {key} caption")
+    total_changes = cache._conn.total_changes
+
+    assert cache.get("caption", "first") == "the first caption"
+    assert cache.get("caption", "missing") is None
+    assert cache._conn.total_changes == total_changes
+
+    cache.put("caption", "fourth", "the fourth caption")
+
+    assert cache.get("caption", "first") == "the first caption"
+    assert cache.get("caption", "second") is None
+    assert cache.stats()["kinds"]["caption"] == {"hits": 2, "misses": 2}
+    cache.close()
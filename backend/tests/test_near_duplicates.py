@@ -0,0 +1,91 @@
+import os
+
+from PIL import Image, ImageDraw
+
+from near_duplicates import NearDuplicateIndex, degenerate, dhash, hamming
+
+
+def near(value: int, bits: int) -> int:
+    return value ^ ((1 << bits) - 1)
+
+
+def test_near_hashes_share_a_cluster(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "near.db"), max_distance=6)
+    base = 0x0F0F_3C3C_5A5A_A5A5
+
+    first = index.add("a.jpg", base)
+    assert index.add("b.jpg", near(base, 3)) == first
+    assert index.add("c.jpg", ~base & (2 ** 64 - 1)) != first
+    assert index.nearest(near(base, 1)) == ("a.jpg", 1)
+    assert index.nearest(near(base, 20)) is None
+    assert index.cluster_info("b.jpg") == {"size": 2, "first_image": "a.jpg"}
+    assert index.cluster_info("c.jpg") is None
+    index.close()
+
+
+def test_reviewed_caption_wins(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "near.db"))
+    cluster = index.add("a.jpg", 1234)
+
+    index.set_caption(cluster, "model caption")
+    index.set_caption(cluster, "reviewed caption", source="reviewed")
+    index.set_caption(cluster, "later model caption")
+
+    assert index.caption(cluster) == "reviewed caption"
+    index.close()
+
+
+def test_rehashed_image_moves_cluster(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "near.db"))
+    base = 0xFFFF_0000_FFFF_0000
+    first = index.add("a.jpg", base)
+    index.add("b.jpg", base)
+
+    moved = index.add("b.jpg", ~base & (2 ** 64 - 1))
+
+    assert moved != first
+    assert index.cluster_info("a.jpg") is None
+    index.close()
+
+
+def test_other_processes_hashes_are_seen(tmp_path):
+    path = str(tmp_path / "near.db")
+    writer, reader = NearDuplicateIndex(path), NearDuplicateIndex(path)
+
+    base = 0x00FF_00FF_00FF_00FF
+    cluster = writer.add("a.jpg", base)
+
+    assert reader.nearest(base) == ("a.jpg", 0)
+    assert reader.add("b.jpg", near(base, 1)) == cluster
+    writer.close()
+    reader.close()
+
+
+def test_resized_copy_is_a_near_duplicate(tmp_path):
+    image = Image.new("RGB", (320, 240), (200, 200, 200))
+    ImageDraw.Draw(image).rectangle((40, 60, 200, 180), fill=(30, 30, 120))
+    image.save(tmp_path / "original.jpg", quality=95)
+    image.resize((160, 120)).save(tmp_path / "small.jpg", quality=70)
+    index = NearDuplicateIndex(str(tmp_path / "near.db"))
+
+    cluster = index.add_file(str(tmp_path / "original.jpg"), "original.jpg")
+
+    assert hamming(dhash(str(tmp_path / "original.jpg")), dhash(str(tmp_path / "small.jpg"))) <= 6
+    assert index.add_file(str(tmp_path / "small.jpg"), "small.jpg") == cluster
+    assert index.add_file(os.path.join(tmp_path, "original.jpg"), "original.jpg") == cluster
+    index.close()
+
+
+def test_degenerate_hashes_are_not_clustered(tmp_path):
+    Image.new("RGB", (320, 240), (128, 128, 128)).save(tmp_path / "blank.jpg")
+    Image.new("RGB", (160, 120), (20, 20, 20)).save(tmp_path / "dark.jpg")
+    index = NearDuplicateIndex(str(tmp_path / "near.db"))
+
+    assert degenerate(dhash(str(tmp_path / "blank.jpg")))
+    assert index.add_file(str(tmp_path / "blank.jpg"), "blank.jpg") is None
+    assert index.add_file(str(tmp_path / "dark.jpg"), "dark.jpg") is None
+    assert index.add("ones.jpg", 2 ** 64 - 1) is None
+    assert index.nearest(0) is None
+    assert index.cluster_of("blank.jpg") is None and index.cluster_info("dark.jpg") is None
+    assert index.stats()["degenerate"] == 3 and index.stats()["near_duplicates"] == 0
+    index.close()
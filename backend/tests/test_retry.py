@@ -0,0 +1,186 @@
+import asyncio
+import random
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import openrouter_client
+from mock_openrouter import start_mock_server
+from openrouter_client import OpenRouterClient
+from retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+def test_delay_doubles_up_to_max_delay_then_gives_up():
+    policy = RetryPolicy(max_retries=5, base_delay=1, max_delay=5, jitter=0)
+
+    assert [policy.delay(attempt) for attempt in range(6)] == [1, 2, 4, 5, 5, None]
+
+
+def test_delay_jitter_stays_below_the_ceiling():
+    random.seed(0)
+    policy = RetryPolicy(base_delay=2, jitter=0.5)
+
+    delays = [policy.delay(1) for _ in range(200)]
+
+    assert all(2 <= delay <= 4 for delay in delays)
+    assert min(delays) < 2.5 and max(delays) > 3.5
+
+
+def test_retry_after_overrides_backoff_up_to_max_retry_after():
+    policy = RetryPolicy(max_retries=3, base_delay=1, max_retry_after=10)
+
+    assert policy.delay(0, retry_after=7.5) == 7.5
+    assert policy.delay(0, retry_after=0) == 0
+    assert policy.delay(0, retry_after=11) is None
+    assert policy.delay(3, retry_after=1) is None
+
+
+def test_parse_retry_after():
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+
+    assert RetryPolicy.parse_retry_after("5") == 5
+    assert RetryPolicy.parse_retry_after("-3") == 0
+    assert 55 < RetryPolicy.parse_retry_after(in_a_minute) <= 60
+    assert RetryPolicy.parse_retry_after("soon") is None
+    assert RetryPolicy.parse_retry_after(None) is None
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("model", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    open_breaker(breaker)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["times_opened"] == 1
+
+
+def test_breaker_lets_one_trial_through_after_reset_timeout():
+    breaker = CircuitBreaker("model", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker("model", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_unreported_trial_stops_blocking_after_reset_timeout():
+    breaker = CircuitBreaker("model", failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    breaker.before_call()
+
+    breaker._trial_started -= 30
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+PAYLOAD = {"model": "mock/gemma", "messages": [{"role": "user", "content": [{"type": "text", "text": "Describe."}]}]}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """A mock OpenRouter that fails every request (with ``Retry-After: 1``), and the sleeps the client made."""
+    server, url, state = start_mock_server(latency=0, error_rate=1.0)
+    sleeps = []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(openrouter_client.asyncio, "sleep", sleep)
+    yield url, state, sleeps
+    server.shutdown()
+
+
+def complete(client: OpenRouterClient, calls: int = 1) -> list:
+    """Make ``calls`` requests one after another; returns each result or the exception it raised."""
+    async def run():
+        results = []
+        try:
+            for _ in range(calls):
+                try:
+                    results.append(await client.chat_completion(PAYLOAD))
+                except Exception as e:
+                    results.append(e)
+        finally:
+            await client.close()
+        return results
+    return asyncio.run(run())
+
+
+def test_client_retries_then_gives_up(upstream):
+    url, state, sleeps = upstream
+    client = OpenRouterClient(url, "", "", "", retry_policy=RetryPolicy(max_retries=2), breaker_threshold=10)
+
+    error, = complete(client)
+
+    assert isinstance(error, httpx.HTTPStatusError)
+    assert sleeps == [1.0, 1.0]
+    assert state.requests == 3
+    assert {key: client.counters[key] for key in ("requests", "retries", "giveups", "successes")} == {
+        "requests": 3, "retries": 2, "giveups": 1, "successes": 0,
+    }
+
+
+def test_client_recovers_on_retry(upstream, monkeypatch):
+    url, state, sleeps = upstream
+    client = OpenRouterClient(url, "", "", "", retry_policy=RetryPolicy(max_retries=2))
+
+    async def sleep(delay):
+        sleeps.append(delay)
+        state.error_rate = 0.0
+
+    monkeypatch.setattr(openrouter_client.asyncio, "sleep", sleep)
+    result, = complete(client)
+
+    assert result["choices"][0]["message"]["content"]
+    assert client.counters["retries"] == 1
+    assert client.counters["successes"] == 1
+
+
+def test_open_breaker_rejects_without_a_request(upstream):
+    url, state, _ = upstream
+    client = OpenRouterClient(url, "", "", "", retry_policy=RetryPolicy(max_retries=2), breaker_threshold=3)
+
+    first, second = complete(client, calls=2)
+
+    assert isinstance(first, httpx.HTTPStatusError)
+    assert isinstance(second, CircuitOpenError)
+    assert state.requests == 3
+    assert client.counters["rejected"] == 1
+    assert client.stats()["breakers"]["mock/gemma"]["state"] == "open"
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import core
+import main
+from conftest import saved_entries, textured_image
+
+
+def save_request(image: str, reviewer: str, caption: str = "A car with a dented door.") -> tuple:
+    return ("POST", "/review", {
+        "json": {"action": "save", "image_path": image, "gemma_caption": caption, "fetch_next": False},
+        "headers": {"X-Reviewer-Id": reviewer},
+    })
+
+
+def save(call, image: str, reviewer: str):
+    method, url, options = save_request(image, reviewer)
+    return call(method, url, **options)
+
+
+def test_reviewers_get_different_images(add_images, request_all, call):
+    add_images("leases", 3)
+
+    first, second = request_all(
+        ("GET", "/review", {"headers": {"X-Reviewer-Id": "r1"}}),
+        ("GET", "/review", {"headers": {"X-Reviewer-Id": "r2"}}),
+    )
+
+    assert first.status_code == second.status_code == 200
+    assert first.json()["image_path"] != second.json()["image_path"]
+    assert first.json()["gemma_caption"]
+    assert "near_duplicates" not in first.json() and "near_duplicates" not in second.json()
+    again = call("GET", "/review", headers={"X-Reviewer-Id": "r1"})
+    assert again.json()["image_path"] == first.json()["image_path"]
+
+
+def test_save_of_image_leased_to_another_reviewer_is_rejected(add_images, call):
+    image, = add_images("leased_elsewhere", 1)
+    assert core.lease_image(image, "alice")
+
+    response = save(call, image, "bob")
+
+    assert response.status_code == 409
+    assert "another reviewer" in response.json()["detail"]
+    assert not core.image_index.is_processed(image)
+
+
+def test_second_save_is_rejected(add_images, call):
+    image, = add_images("saved_twice", 1)
+    assert save(call, image, "alice").status_code == 200
+
+    response = save(call, image, "alice")
+
+    assert response.status_code == 409
+    assert len(saved_entries(core.generated_store, image)) == 1
+
+
+def test_concurrent_saves_write_one_entry(add_images, request_all):
+    image, = add_images("concurrent_saves", 1)
+    assert core.lease_image(image, "alice")
+
+    responses = request_all(*(save_request(image, "alice") for _ in range(3)))
+
+    assert sorted(response.status_code for response in responses) == [200, 409, 409]
+    assert len(saved_entries(core.generated_store, image)) == 1
+    assert core.image_index.is_processed(image)
+
+
+def test_failed_append_releases_the_claim(add_images, call, monkeypatch):
+    image, = add_images("failed_append", 1)
+
+    def append(entry):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(core.generated_store, "append", append)
+    with pytest.raises(OSError):
+        save(call, image, "alice")
+
+    assert not core.image_index.is_processed(image)
+
+
+@pytest.mark.parametrize("image_path", ["../secret.txt", "/etc/hostname", "missing/img0.jpg"])
+def test_save_rejects_paths_that_are_not_indexed_images(image_path, call):
+    saved = len(saved_entries(core.generated_store, image_path))
+
+    response = save(call, image_path, "alice")
+
+    assert response.status_code == 400
+    assert len(saved_entries(core.generated_store, image_path)) == saved
+
+
+def test_batch_captioning_skips_leased_images(add_images):
+    leased, free = add_images("batch_leases", 2)
+    assert core.lease_image(leased, "alice")
+
+    pending = {relative_path for _, relative_path in core.image_index.iter_pending()}
+
+    assert free in pending and leased not in pending
+    assert not core.image_index.claim(leased, "batch")
+
+
+def test_near_duplicate_gets_the_reviewed_caption_as_a_proposal(add_images, call, loop):
+    first, = add_images("near_duplicate_group", 1)
+    copy = "near_duplicate_group/copy.jpg"
+    textured_image(first).save(os.path.join(core.root_folder, copy), format="JPEG", quality=70)
+    core.image_index.add_file(copy)
+    for relative_path in (first, copy):
+        core.near_duplicate_cluster(os.path.join(core.root_folder, relative_path), relative_path)
+    method, url, options = save_request(first, "alice", caption="A reviewed caption.")
+    assert call(method, url, **options).status_code == 200
+
+    response = loop.run_until_complete(main.review_response(copy, "A model caption."))
+
+    assert response["gemma_caption"] == "A model caption."
+    assert response["proposed_caption"] == "A reviewed caption."
+    assert response["near_duplicates"] == {"size": 2, "first_image": first}
+
+
+def test_sync_keeps_images_claimed_for_a_pending_append(add_images):
+    claimed, saved = add_images("claimed_during_sync", 2)
+    assert core.image_index.claim(claimed, "alice")
+    assert core.image_index.claim(saved, "bob")
+    core.image_index.mark_processed(saved)
+
+    core.image_index.sync_processed(core.generated_store.images())
+
+    assert core.image_index.is_processed(claimed)
+    assert not core.image_index.is_processed(saved)
+    core.image_index.mark_processed(claimed, False)
+
+
+def test_review_stream_ends_after_the_caption(add_images, call, loop):
+    add_images("stream_end", 1)
+    # A prefetch that never finishes: the stream must not wait for it before closing.
+    never = loop.create_task(asyncio.sleep(3600))
+    core.prefetcher.slots["stream_end/never.jpg"] = never
+    started = time.monotonic()
+    try:
+        response = call("GET", "/review/stream", headers={"X-Reviewer-Id": "streamer"})
+    finally:
+        core.prefetcher.slots.pop("stream_end/never.jpg", None)
+        never.cancel()
+
+    events = [line.split(":", 1)[1].strip() for line in response.text.splitlines() if line.startswith("event:")]
+    assert events[0] == "image" and events[-1] in ("caption", "next")
+    assert time.monotonic() - started < 5
@@ -0,0 +1,104 @@
+import io
+import os
+
+import core
+from conftest import DATA_DIR, textured_image
+
+
+def jpeg_bytes(seed: str) -> bytes:
+    buffer = io.BytesIO()
+    textured_image(seed).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def upload(request_all, *files) -> dict:
+    """Upload ``(filename, content, content_type)`` files as one folder and return the summary."""
+    response, = request_all(("POST", "/upload_folder", {
+        "files": [("files", file) for file in files],
+    }))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def leftover_temp_files() -> list:
+    return [
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(DATA_DIR)
+        for name in names if name.startswith(".upload-")
+    ]
+
+
+def test_upload_saves_indexes_and_thumbnails(request_all):
+    summary = upload(request_all, ("upload_ok/a.jpg", jpeg_bytes("upload_ok/a"), "image/jpeg"))
+
+    assert summary["saved"] == 1 and not summary["errors"]
+    assert core.image_index.is_indexed("upload_ok/a.jpg")
+    assert os.path.exists(core.upload_ingestor.thumbnail_path("upload_ok/a.jpg"))
+    assert leftover_temp_files() == []
+
+
+def test_upload_skips_files_that_are_not_images(request_all):
+    summary = upload(
+        request_all,
+        ("upload_signature/fake.jpg", b"definitely not a jpeg", "image/jpeg"),
+        ("upload_signature/notes.txt", b"notes", "text/plain"),
+        ("upload_signature/truncated.jpg", jpeg_bytes("truncated")[:40], "image/jpeg"),
+    )
+
+    assert summary["saved"] == 0
+    assert summary["skipped"] == 2
+    assert len(summary["errors"]) == 1 and summary["errors"][0].startswith("upload_signature/truncated.jpg")
+    assert not os.path.exists(os.path.join(core.root_folder, "upload_signature", "fake.jpg"))
+    assert not os.path.exists(os.path.join(core.root_folder, "upload_signature", "truncated.jpg"))
+    assert leftover_temp_files() == []
+
+
+def test_upload_skips_files_over_the_size_limit(request_all, monkeypatch):
+    content = jpeg_bytes("upload_size/big")
+    monkeypatch.setattr(core.upload_ingestor, "max_file_bytes", len(content) - 1)
+
+    summary = upload(request_all, ("upload_size/big.jpg", content, "image/jpeg"))
+
+    assert summary["skipped"] == 1 and summary["saved"] == 0
+    assert not os.path.exists(os.path.join(core.root_folder, "upload_size", "big.jpg"))
+    assert leftover_temp_files() == []
+
+
+def test_upload_paths_cannot_escape_car_data(request_all):
+    summary = upload(
+        request_all,
+        ("../escape.jpg", jpeg_bytes("escape1"), "image/jpeg"),
+        ("upload_escape/../../escape.jpg", jpeg_bytes("escape2"), "image/jpeg"),
+        ("/upload_escape/absolute.jpg", jpeg_bytes("escape3"), "image/jpeg"),
+    )
+
+    assert summary["skipped"] == 2 and summary["saved"] == 1
+    assert not os.path.exists(os.path.join(DATA_DIR, "escape.jpg"))
+    assert os.path.exists(os.path.join(core.root_folder, "upload_escape", "absolute.jpg"))
+
+
+def test_upload_skips_duplicates_within_one_upload(request_all):
+    content = jpeg_bytes("upload_same/a")
+
+    summary = upload(
+        request_all,
+        ("upload_same/a.jpg", content, "image/jpeg"),
+        ("upload_same/copy.jpg", content, "image/jpeg"),
+    )
+
+    assert summary["saved"] == 1 and summary["duplicates"] == 1
+    saved = [name for name in ("a.jpg", "copy.jpg") if os.path.exists(os.path.join(core.root_folder, "upload_same", name))]
+    assert len(saved) == 1
+    assert leftover_temp_files() == []
+
+
+def test_upload_skips_copies_of_scanned_images(add_images, request_all):
+    image, = add_images("upload_scanned", 1)
+    with open(os.path.join(core.root_folder, image), "rb") as file:
+        content = file.read()
+
+    summary = upload(request_all, ("upload_scanned_copy/a.jpg", content, "image/jpeg"))
+
+    assert summary["duplicates"] == 1 and summary["saved"] == 0
+    assert not os.path.exists(os.path.join(core.root_folder, "upload_scanned_copy", "a.jpg"))
+    assert leftover_temp_files() == []
@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import hashlib
+import os
+import posixpath
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from PIL import Image, ImageOps
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from image_index import IMAGE_EXTENSIONS, ImageIndex
+from metrics import log
+from near_duplicates import NearDuplicateIndex
+
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n")
+
+
+class UploadError(Exception):
+    pass
+
+
+class _Part:
+    def __init__(self):
+        self.headers: dict = {}
+        self.relative_path: Optional[str] = None
+        self.content_type = ""
+        self.temp_path: Optional[str] = None
+        self.file = None
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.ended = False
+        self.skip_reason: Optional[str] = None
+
+
+class UploadIngestor:
+    """Streams a multipart folder upload straight to disk.
+
+    The request body is parsed as it arrives, so no part is spooled in
+    full. Each file is written to a temp file next to its target while its
+    SHA-256 is computed. When a part ends, a bounded thread pool verifies
+    it with Pillow, skips it if the same content is already indexed (scanned
+    images of the same size are hashed on demand for this), writes a
+    review-sized JPEG thumbnail, moves it into place and registers it in the
+    image index (and its perceptual hash in ``near_duplicates``, if given).
+    Finishing a file runs in parallel with reading the next part.
+    """
+
+    def __init__(self, root_folder: str, thumbnail_folder: str, image_index: ImageIndex,
+                 max_file_bytes: int = 50 * 1024 * 1024, thumbnail_edge: int = 1024, workers: int = 4,
+                 near_duplicates: Optional[NearDuplicateIndex] = None):
+        self.root_folder = root_folder
+        self.thumbnail_folder = thumbnail_folder
+        self.image_index = image_index
+        self.near_duplicates = near_duplicates
+        self.max_file_bytes = max_file_bytes
+        self.thumbnail_edge = thumbnail_edge
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._hash_lock = threading.Lock()
+        self._hashes_in_progress: set = set()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def thumbnail_path(self, relative_path: str) -> str:
+        return os.path.join(self.thumbnail_folder, f"{relative_path}.jpg")
+
+    @staticmethod
+    def clean_relative_path(filename: str) -> Optional[str]:
+        path = posixpath.normpath(filename.replace("\\", "/")).lstrip("/")
+        if not path or path == "." or path.startswith("../") or path == "..":
+            return None
+        return path
+
+    async def ingest(self, content_type: str, chunks, on_image: Callable[[str], None]) -> dict:
+        """Consume ``chunks`` (an async iterator of body bytes) and return a summary."""
+        mime_type, params = parse_options_header(content_type)
+        if mime_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError("Expected a multipart/form-data body")
+
+        loop = asyncio.get_running_loop()
+        summary = {"saved": 0, "duplicates": 0, "skipped": 0, "errors": []}
+
+        def in_pool(function, *args):
+            # A copy of the context per call, so worker threads log with the request's trace id.
+            return loop.run_in_executor(self._pool, contextvars.copy_context().run, function, *args)
+
+        events: list = []
+        header_field = bytearray()
+        header_value = bytearray()
+        parts: dict = {"current": None}
+
+        def on_part_begin():
+            parts["current"] = _Part()
+
+        def on_header_field(data, start, end):
+            header_field.extend(data[start:end])
+
+        def on_header_value(data, start, end):
+            header_value.extend(data[start:end])
+
+        def on_header_end():
+            parts["current"].headers[bytes(header_field).lower()] = bytes(header_value)
+            header_field.clear()
+            header_value.clear()
+
+        def on_headers_finished():
+            events.append(("begin", parts["current"]))
+
+        def on_part_data(data, start, end):
+            events.append(("data", parts["current"], bytes(data[start:end])))
+
+        def on_part_end():
+            events.append(("end", parts["current"]))
+
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        })
+
+        pending: set = set()
+        slots = asyncio.Semaphore(self.workers * 2)
+
+        async def finish(part: _Part):
+            try:
+                outcome = await in_pool(self._finalize, part)
+            except Exception as e:
+                summary["errors"].append(f"{part.relative_path}: {str(e)}")
+                await in_pool(self._discard, part)
+            else:
+                if outcome == "saved":
+                    summary["saved"] += 1
+                    on_image(part.relative_path)
+                else:
+                    summary["duplicates"] += 1
+            finally:
+                slots.release()
+
+        try:
+            async for chunk in chunks:
+                parser.write(chunk)
+                for event in events:
+                    kind, part = event[0], event[1]
+                    if kind == "begin":
+                        await in_pool(self._begin, part)
+                        if part.skip_reason:
+                            summary["skipped"] += 1
+                            log(f"Skipping {part.relative_path or 'upload part'}: {part.skip_reason}", level="warning")
+                    elif part.skip_reason:
+                        continue
+                    elif kind == "data":
+                        await in_pool(self._write, part, event[2])
+                        if part.skip_reason:
+                            summary["skipped"] += 1
+                            log(f"Skipping {part.relative_path}: {part.skip_reason}", level="warning")
+                            await in_pool(self._discard, part)
+                    elif kind == "end":
+                        part.ended = True
+                        await slots.acquire()
+                        task = asyncio.create_task(finish(part))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                events.clear()
+            parser.finalize()
+        finally:
+            if pending:
+                await asyncio.gather(*pending)
+            current = parts["current"]
+            if current is not None and not current.ended:
+                await in_pool(self._discard, current)
+        return summary
+
+    def _begin(self, part: _Part):
+        _, disposition = parse_options_header(part.headers.get(b"content-disposition", b""))
+        filename = disposition.get(b"filename", b"").decode("utf-8", "replace")
+        part.content_type = part.headers.get(b"content-type", b"").decode("latin-1")
+        part.relative_path = self.clean_relative_path(filename) if filename else None
+        if part.relative_path is None:
+            part.skip_reason = "no usable filename"
+        elif not part.content_type.startswith("image/") or not part.relative_path.lower().endswith(IMAGE_EXTENSIONS):
+            part.skip_reason = "not an image"
+        if part.skip_reason:
+            return
+        target_path = os.path.join(self.root_folder, part.relative_path)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        part.temp_path = os.path.join(os.path.dirname(target_path), f".upload-{uuid.uuid4().hex}.part")
+        part.file = open(part.temp_path, "wb")
+
+    def _write(self, part: _Part, data: bytes):
+        if len(part.head) < 8:
+            part.head += data[:8 - len(part.head)]
+            if not any(part.head[:len(sig)] == sig[:len(part.head)] for sig in IMAGE_SIGNATURES):
+                part.skip_reason = "content is not a JPEG or PNG image"
+                return
+        part.size += len(data)
+        if part.size > self.max_file_bytes:
+            part.skip_reason = f"larger than {self.max_file_bytes} bytes"
+            return
+        part.digest.update(data)
+        part.file.write(data)
+
+    def _discard(self, part: _Part):
+        if part.file is not None and not part.file.closed:
+            part.file.close()
+        if part.temp_path and os.path.exists(part.temp_path):
+            os.remove(part.temp_path)
+
+    def _finalize(self, part: _Part) -> str:
+        part.file.close()
+        if part.size == 0:
+            raise UploadError("empty file")
+        sha256 = part.digest.hexdigest()
+        with self._hash_lock:
+            existing = self.image_index.find_by_hash(sha256, size=part.size)
+            if (existing and os.path.exists(os.path.join(self.root_folder, existing))) \
+                    or sha256 in self._hashes_in_progress:
+                self._discard(part)
+                log(f"Skipping duplicate upload {part.relative_path} (same content as {existing or 'another file in this upload'})",
+                    image=part.relative_path)
+                return "duplicate"
+            self._hashes_in_progress.add(sha256)
+        try:
+            with Image.open(part.temp_path) as image:
+                image.verify()
+            self._write_thumbnail(part.temp_path, part.relative_path)
+            target_path = os.path.join(self.root_folder, part.relative_path)
+            os.replace(part.temp_path, target_path)
+            self.image_index.add_file(part.relative_path, sha256=sha256)
+            if self.near_duplicates is not None:
+                try:
+                    self.near_duplicates.add_file(target_path, part.relative_path)
+                except Exception as e:
+                    log(f"Could not hash {part.relative_path} for near-duplicate detection: {str(e)}", level="warning",
+                        image=part.relative_path)
+        finally:
+            with self._hash_lock:
+                self._hashes_in_progress.discard(sha256)
+        log(f"Saved file: {os.path.join(self.root_folder, part.relative_path)}", image=part.relative_path)
+        return "saved"
+
+    def _write_thumbnail(self, source_path: str, relative_path: str):
+        thumbnail_path = self.thumbnail_path(relative_path)
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((self.thumbnail_edge, self.thumbnail_edge))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(thumbnail_path, format="JPEG", quality=85)
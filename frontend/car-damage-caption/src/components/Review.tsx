@@ -1,12 +1,16 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import '../App.css';
 import Toast from './Toast';
 
 interface ReviewData {
   image_path: string;
+  thumbnail_path?: string;
   gemma_caption: string;
   total: number;
+  counts?: { pending: number; leased: number; done: number };
+  near_duplicates?: { size: number; first_image: string };
+  proposed_caption?: string;
   gemma_score?: number | null;
   gemma_explanation?: string;
   manual_score?: number | null;
@@ -25,6 +29,83 @@ interface ToastMessage {
 const API_BASE_URL = 'http://localhost:8000';  
 // http://127.0.0.1:8000
 
+// Each browser gets its own reviewer id so the backend can lease it a distinct image.
+const getReviewerId = (): string => {
+  let reviewerId = localStorage.getItem('reviewerId');
+  if (!reviewerId) {
+    reviewerId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+    localStorage.setItem('reviewerId', reviewerId);
+  }
+  return reviewerId;
+};
+
+const reviewHeaders = { 'X-Reviewer-Id': getReviewerId() };
+
+interface NextImage {
+  image_path: string;
+  thumbnail_path?: string;
+}
+
+type ReviewStreamEvent =
+  | { event: 'image'; data: ReviewData }
+  | { event: 'token'; data: { text: string } }
+  | { event: 'caption'; data: { image_path: string; gemma_caption: string } }
+  | { event: 'next'; data: NextImage }
+  | { event: 'done'; data: { message: string; done: boolean } }
+  | { event: 'error'; data: { detail: string } };
+
+type CheckStreamEvent =
+  | {
+      event: 'score';
+      data: {
+        target: 'gemma' | 'manual' | 'candidate';
+        index: number | null;
+        score: number | null;
+        explanation: string;
+      };
+    }
+  | { event: 'done'; data: Record<string, never> };
+
+// Reads a server-sent event stream from fetch (EventSource cannot send headers or POST bodies).
+// The payload of each event is trusted to match the type the caller names for the endpoint.
+const streamEvents = async <T extends { event: string; data: unknown }>(
+  url: string,
+  init: RequestInit,
+  onEvent: (message: T) => void
+) => {
+  const response = await fetch(url, init);
+  if (!response.ok || !response.body) {
+    throw new Error(`Request failed with status code ${response.status}`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary: number;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (data) onEvent({ event, data: JSON.parse(data) as unknown } as T);
+    }
+  }
+};
+
+const preloadImage = (next: NextImage) => {
+  const image = new Image();
+  image.src = next.thumbnail_path
+    ? `${API_BASE_URL}/thumbnails/${next.thumbnail_path}`
+    : `${API_BASE_URL}/images/${next.image_path}`;
+};
+
 const Review: React.FC = () => {
   const [reviewData, setReviewData] = useState<ReviewData | null>(null);
   const [manualCaption, setManualCaption] = useState<string>('');
@@ -32,9 +113,11 @@ const Review: React.FC = () => {
   const [toasts, setToasts] = useState<ToastMessage[]>([]);
   const [toastId, setToastId] = useState<number>(0);
   const [currentActionToastId, setCurrentActionToastId] = useState<number | null>(null);
+  const reviewStream = useRef<AbortController | null>(null);
 
   useEffect(() => {
     fetchReview();
+    return () => reviewStream.current?.abort();
   }, []);
 
   const addToast = (
@@ -64,41 +147,87 @@ const Review: React.FC = () => {
     }
   };
 
-  const fetchReview = async () => {
-    setIsLoading(true);
-    try {
-      const response = await axios.get<ReviewData>(`${API_BASE_URL}/review`);
-      console.log('Fetch Review Response:', response.data);
-      setReviewData(response.data);
-      setManualCaption('');
-    } catch (error) {
-      addToast(`Error fetching review: ${(error as Error).message}`, 'error');
-    } finally {
-      setIsLoading(false);
-    }
-  };
+  // The image shows as soon as it is leased; the caption fills in as Gemma streams it.
+  // Resolves once the caption is complete. The stream may still deliver the next event
+  // (used to preload the following image); it is cancelled when the next review is
+  // fetched or the page unmounts.
+  const fetchReview = () =>
+    new Promise<void>((resolve) => {
+      reviewStream.current?.abort();
+      const controller = new AbortController();
+      reviewStream.current = controller;
+      setIsLoading(true);
+      let settled = false;
+      const settle = () => {
+        if (settled) return;
+        settled = true;
+        if (reviewStream.current === controller) setIsLoading(false);
+        resolve();
+      };
+      const init = { headers: reviewHeaders, signal: controller.signal };
+      streamEvents<ReviewStreamEvent>(`${API_BASE_URL}/review/stream`, init, (message) => {
+        if (controller.signal.aborted) return;
+        switch (message.event) {
+          case 'image':
+            setReviewData({ ...message.data, gemma_score: null, manual_score: null });
+            setManualCaption('');
+            break;
+          case 'token': {
+            const { text } = message.data;
+            setReviewData((prev) => prev && { ...prev, gemma_caption: prev.gemma_caption + text });
+            break;
+          }
+          case 'caption': {
+            const { gemma_caption } = message.data;
+            setReviewData((prev) => prev && { ...prev, gemma_caption });
+            settle();
+            break;
+          }
+          case 'next':
+            preloadImage(message.data);
+            break;
+          case 'done':
+            setReviewData({ ...message.data, image_path: '', gemma_caption: '', total: 0 });
+            settle();
+            break;
+          case 'error':
+            addToast(`Error fetching review: ${message.data.detail}`, 'error');
+            settle();
+            break;
+        }
+      })
+        .catch((error: Error) => {
+          if (!settled && !controller.signal.aborted) addToast(`Error fetching review: ${error.message}`, 'error');
+        })
+        .finally(settle);
+    });
 
   const handleCheck = async () => {
     if (!reviewData || isLoading) return;
     setIsLoading(true);
     addToast('Evaluating...', 'info', Infinity);
+    setReviewData({ ...reviewData, gemma_score: null, gemma_explanation: '', manual_score: null, manual_explanation: '' });
     try {
-      const response = await axios.post<Partial<ReviewData>>(`${API_BASE_URL}/review`, {
-        action: 'check',
-        image_path: reviewData.image_path,
-        gemma_caption: reviewData.gemma_caption,
-        manual_caption: manualCaption,
+      // Each score shows as soon as Pixtral returns it.
+      await streamEvents<CheckStreamEvent>(`${API_BASE_URL}/review/check/stream`, {
+        method: 'POST',
+        headers: { ...reviewHeaders, 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          action: 'check',
+          image_path: reviewData.image_path,
+          gemma_caption: reviewData.gemma_caption,
+          manual_caption: manualCaption,
+        }),
+      }, (message) => {
+        if (message.event !== 'score') return;
+        const { target, score, explanation } = message.data;
+        if (target !== 'gemma' && target !== 'manual') return;
+        setReviewData((prev) => prev && {
+          ...prev,
+          [`${target}_score`]: score ?? null,
+          [`${target}_explanation`]: explanation ?? '',
+        });
       });
-      console.log('Check Response:', response.data);
-      const updatedData = {
-        ...reviewData,
-        gemma_score: response.data.gemma_score ?? null,
-        gemma_explanation: response.data.gemma_explanation ?? '',
-        manual_score: response.data.manual_score ?? null,
-        manual_explanation: response.data.manual_explanation ?? '',
-      };
-      setReviewData(updatedData);
-      console.log('Updated reviewData:', updatedData);
       addToast('Evaluation completed', 'success', 3000, true);
     } catch (error) {
       console.error('Check Error:', error);
@@ -120,15 +249,13 @@ const Review: React.FC = () => {
         manual_caption: manualCaption,
         gemma_score: reviewData.gemma_score,
         manual_score: reviewData.manual_score,
-      });
+        gemma_explanation: reviewData.gemma_explanation,
+        manual_explanation: reviewData.manual_explanation,
+        fetch_next: false,
+      }, { headers: reviewHeaders });
       console.log('Save Response:', response.data);
-      if (response.data.done) {
-        setReviewData({ ...response.data, image_path: '', gemma_caption: '' });
-      } else {
-        setReviewData({ ...response.data, gemma_score: null, manual_score: null });
-        setManualCaption('');
-      }
       addToast(response.data.message || 'Saved successfully', 'success', 3000, true);
+      await fetchReview();
     } catch (error) {
       console.error('Save Error:', error);
       addToast(`Error saving: ${(error as Error).message}`, 'error', 3000, true);
@@ -251,13 +378,34 @@ const Review: React.FC = () => {
         <div className="review-grid">
           <div className="image-section">
             <div className="image-container">
-              <img src={`${API_BASE_URL}/images/${reviewData?.image_path}`} alt="Car" />
+              <img
+                src={
+                  reviewData?.thumbnail_path
+                    ? `${API_BASE_URL}/thumbnails/${reviewData.thumbnail_path}`
+                    : `${API_BASE_URL}/images/${reviewData?.image_path}`
+                }
+                alt="Car"
+              />
             </div>
             <p className="image-info">
-              Processing image: {reviewData?.image_path} (Remaining: {reviewData?.total})
+              Processing image: {reviewData?.image_path} (Remaining: {reviewData?.total}{reviewData?.counts ? `, ${reviewData.counts.leased} in review` : ''})
             </p>
+            {reviewData?.near_duplicates && (
+              <p className="image-info">
+                Near-duplicate group of {reviewData.near_duplicates.size} images (first: {reviewData.near_duplicates.first_image}).
+              </p>
+            )}
           </div>
           <div className="form-section">
+            {reviewData?.proposed_caption && (
+              <div className="description-card">
+                <label>Proposed from the near-duplicate group</label>
+                <p>{reviewData.proposed_caption}</p>
+                <button className="btn btn-secondary" onClick={() => setManualCaption(reviewData.proposed_caption!)} disabled={isLoading}>
+                  Use as Manual Description
+                </button>
+              </div>
+            )}
             <div className="description-card">
               <label htmlFor="gemma_caption">Generated Description</label>
               <textarea